@@ -1,412 +1,86 @@
 import os
-import boto3
-from dotenv import load_dotenv
-from flask import Flask, request, jsonify
-from datetime import datetime
-from sqlalchemy.exc import IntegrityError
-from models import db, connect_db, User, Property, Booking
-from aws_s3 import Aws, AWS_ACCESS_KEY, AWS_SECRET_ACCESS_KEY
-from flask_cors import CORS, cross_origin
-from flask_jwt_extended import (
-    create_access_token,
-    get_jwt_identity,
-    jwt_required,
-    JWTManager,
-)
 
-s3 = boto3.resource("s3")
+from dotenv import load_dotenv
+from flask import Flask
+from flask_cors import CORS
+from flask_jwt_extended import JWTManager
+
+import booking_locks
+import bulk
+import cache
+import db_routing
+import s3_gc
+import sql_profiler
+from models import connect_db
 
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
-
-app.config["SQLALCHEMY_ECHO"] = True
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = False
-app.config["SECRET_KEY"] = os.environ["SECRET_KEY"]
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ["DATABASE_URL"]
-app.config["CORS_HEADERS"] = "Content-Type"
-
-# Initialize AWS S3 client
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-)
-
-connect_db(app)
-jwt = JWTManager(app)
-TIME_FORMAT = "%Y-%m-%d"
-
-
-############################# AUTH ############################
-
-
-@app.post("/auth/signup")
-# @expects_json(user_registration_schema)
-def register_user():
-    """Handle user signup.
-
-    Create new user and add to DB. Return JWT
-
-    If the there already is a user with that username: return JSON error
-    """
-
-    username = request.form.get("username")
-    password = request.form.get("password")
-    first_name = request.form.get("first_name")
-    last_name = request.form.get("last_name")
-    email = request.form.get("email")
-
-    user = User.signup(
-        username=username,
-        password=password,
-        first_name=first_name,
-        last_name=last_name,
-        email=email,
-    )
-    if user:
-        # Generate the JWT token with the username payload
-        access_token = create_access_token(identity=user.username,
-                                           expires_delta=False)
-        return jsonify(access_token=access_token)
-
-    return jsonify({"error": "Invalid credentials"}), 401
-
-
-@app.post("/auth/login")
-def login_user():
-    """Handle user login.
-    Return JSON of JWT.
-    If Login with invalid credentials, return JSON: invalid.
-    """
-    username = request.form.get("username")
-    password = request.form.get("password")
-
-    user = User.authenticate(username, password)
-
-    if user:
-        access_token = create_access_token(identity=user.username,
-                                           expires_delta=False)
-        return jsonify(access_token=access_token)
-
-    return jsonify({"error": "Invalid credentials"}), 401
-
-
-############################# USER ############################
-
-
-@app.get("/user/<username>")
-@jwt_required()
-def show_user(username):
-    """Given a username
-    Return JSON with user info
-    """
-
-    user = User.query.get_or_404(username)
-    return jsonify(user=user.serialize())
-
-
-@app.patch("/user/<username>")
-@jwt_required()
-def update_user(username):
-    """Given a username and formData
-    Return JSON with updated user info
-    """
-    current_user = get_jwt_identity()
-
-    if current_user != username:
-        return jsonify({"error": "Invalid Authorization"})
-
-    user = User.query.get_or_404(username)
-
-    user.first_name = request.form.get("first_name", user.first_name)
-    user.last_name = request.form.get("last_name", user.last_name)
-    user.email = request.form.get("email", user.email)
-
-    db.session.commit()
-
-    return jsonify(user=user.serialize())
-
-
-@app.delete("/user/<username>")
-@jwt_required()
-def delete_user(username):
-    """Given a username
-    Delete user from db
-    Return JSON with delete confirmation
-    """
-
-    current_user = get_jwt_identity()
-
-    if current_user != username:
-        return jsonify({"error": "Invalid Authorization"})
-
-    user = User.query.get_or_404(username)
-
-    db.session.delete(user)
-    db.session.commit()
-
-    return jsonify(deleted=user.username)
-
-
-################## PROPERTY ######################
-
-
-@app.post("/property")
-@jwt_required()
-def add_property():
-    """Handles POST request for new property registration.
-
-    Create new property and add to DB & upload files to S3
-
-    Return JSON for newly created property
-    """
-
-    address = request.form.get("address")
-    sqft = request.form.get("sqft")
-    description = request.form.get("description")
-    owner = User.query.get_or_404(get_jwt_identity())
-    price_rate = request.form.get("price_rate")
-
-    img_file = request.files["file"]
-    img_file_name = Aws.upload_file(img_file)
-    img_url = Aws.get_file_url(img_file_name)
-
-    try:
-        property = Property.add_property(
-            address, price_rate, owner, sqft, img_url, description
-        )
-        return (jsonify(property=property.serialize()), 201)
-
-    except IntegrityError:
-        error = f"Property address ({address}) already listed"
-        return jsonify({"error": error})
-
-
-@app.get("/property")
-def get_all_properties():
-    """handles GET request to read all properties
-
-    Return JSON array for all properties
-    """
-
-    properties = Property.query.all()
-    serialized_properties = [p.serialize() for p in properties]
-
-    return (jsonify(properties=serialized_properties), 200)
 
+def create_app(test_config=None):
+    """Create and configure the SharenBn app.
 
-@app.get("/property/<int:property_id>")
-def get_property(property_id):
-    """handles GET request to read specific property based on id
-
-    Return JSON for searched property
-    """
-
-    property = Property.query.get_or_404(property_id)
-    return (jsonify(property=property.serialize()), 200)
-
-
-@app.patch("/property/<int:property_id>")
-@jwt_required()
-def edit_property(property_id):
-    """handles PATCH request to edit specific property based on id
-
-    Return JSON for newly updated property
-    """
-
-    property = Property.query.get_or_404(property_id)
-
-    current_user = get_jwt_identity()
-
-    if current_user != property.owner.username:
-        return jsonify(error="Invalid Authorization")
-
-    property.address = request.form.get("address", property.address)
-    property.sqft = request.form.get("sqft", property.sqft)
-    property.price_rate = request.form.get("price_rate", property.price_rate)
-    property.description = request.form.get(
-        "description", property.description)
-
-    img_file = request.files.get("file")
-
-    if img_file:
-        img_file_name = Aws.upload_file(img_file)
-        property.img_url = Aws.get_file_url(img_file_name)
-
-    try:
-        db.session.commit()
-        serialized_updated_property = property.serialize()
-        return jsonify(property=serialized_updated_property)
-    except IntegrityError:
-        db.session.rollback()
-        return jsonify({"error": f"Duplicate address: {property.address}"})
-
-
-@app.delete("/property/<int:property_id>")
-@jwt_required()
-def delete_property(property_id):
-    """handles DELETE request to delete specific property based on id
-
-    Return JSON for confirmation message
-    """
-
-    property = Property.query.get_or_404(property_id)
-
-    current_user = get_jwt_identity()
-
-    if current_user != property.owner.username:
-        return jsonify({"error": "Invalid Authorization"})
-
-    db.session.delete(property)
-    db.session.commit()
-
-    return jsonify(deleted=property.address)
-
-
-############### BOOKING ################
-
-
-@app.post("/property/<int:property_id>/bookings")
-@jwt_required()
-def book_property(property_id):
-    """Given property Id
-    Create a booking in the DB
-    return JSON with booking info
-    """
-
-    property = Property.query.get_or_404(property_id)
-    start_date_str = request.form.get("start_date")
-    end_date_str = request.form.get("end_date")
-
-    start_date = datetime.strptime(start_date_str, TIME_FORMAT)
-    end_date = datetime.strptime(end_date_str, TIME_FORMAT)
-    total_price = (end_date - start_date).days * property.price_rate
-    current_user = get_jwt_identity()
-
-    if current_user == property.owner.username:
-        return jsonify({"error": "Owner cannot book own property"})
-
-    try:
-        Booking.verify_dates(start_date=start_date,
-                             end_date=end_date,
-                             property_id=property.id)
-
-        booking = Booking.add_booking(
-            address=property.address,
-            username=current_user,
-            total_price=total_price,
-            start_date=start_date,
-            end_date=end_date,
-        )
-
-        return jsonify(booking=booking.serialize())
-    except ValueError:
-        return jsonify({"error":'Start date is after end date.'}), 500
-        # return jsonify(error="start date is after end date")
-    except MemoryError:
-        return jsonify({"error":'Dates are already booked.'}), 500
-        # return jsonify(error="dates are already booked")
-
-
-@app.get("/property/<int:property_id>/bookings")
-@jwt_required()
-def get_property_bookings(property_id):
-    """Given a property id
-    Return JSON of all the property bookings
-    """
-    property = Property.query.get_or_404(property_id)
-
-    if get_jwt_identity() != property.owner.username:
-        return jsonify({"error": "Invalid Authorization"})
-
-    return jsonify(bookings=[b.serialize() for b in property.bookings])
-
-
-@app.get("/user/<username>/bookings")
-@jwt_required()
-def get_user_bookings(username):
-    """Given a username
-    Return JSON of all the bookings for that user
-    """
-    user = User.query.get_or_404(username)
-
-    if get_jwt_identity() != username:
-        return jsonify({"error": "Invalid Authorization"})
-
-    return jsonify(bookings=[b.serialize() for b in user.bookings])
-
-
-@app.get("/bookings/<int:booking_id>")
-@jwt_required()
-def get_booking(booking_id):
-    """Given a booking id
-    Return JSON of the booking
-    """
-    current_user = get_jwt_identity()
-    booking = Booking.query.get_or_404(booking_id)
-    property = Property.query.filter_by(address=booking.address).first()
-
-    if (current_user != booking.username) and (property.owner.username != current_user):
-        return jsonify({"error": "Invalid Authorization"})
-
-    return jsonify(booking=booking.serialize())
-
-
-@app.patch("/bookings/<int:booking_id>")
-@jwt_required()
-def update_booking(booking_id):
-    """Given a property id
-    Update the booking in the database
-    Return JSON of all the updated property booking
+    Nothing here opens a database connection or builds an AWS client, so
+    the app can be created once in a gunicorn master (preload_app) and
+    shared by forked workers.
     """
-    booking = Booking.query.get_or_404(booking_id)
-    property = Property.query.filter_by(address=booking.address).first()
-
-    start_date_str = request.form.get("start_date",
-                                      datetime.strftime(booking.start_date,
-                                                        TIME_FORMAT))
-    end_date_str = request.form.get("end_date",
-                                    datetime.strftime(booking.end_date,
-                                                      TIME_FORMAT))
-
-    booking.start_date = datetime.strptime(start_date_str, TIME_FORMAT)
-    booking.end_date = datetime.strptime(end_date_str, TIME_FORMAT)
-    booking.total_price = (
-        booking.end_date - booking.start_date).days * property.price_rate
-    current_user = get_jwt_identity()
-
-    if current_user != booking.customer.username:
-        return jsonify({"error": "Invalid Authorization"})
-
-    try:
-        Booking.verify_dates(start_date=booking.start_date,
-                             end_date=booking.end_date,
-                             property_id=property.id,
-                             booking_id=booking_id)
-
-        db.session.commit()
-        return jsonify(booking=booking.serialize())
-    except ValueError:
-        return jsonify({"error":'Start date is after end date.'}), 500
-        # return jsonify(error="start date is after end date")
-    except MemoryError:
-        return jsonify({"error":'Dates are already booked.'}), 500
-        # return jsonify(error="dates are already booked")
-
-
-@app.delete("/bookings/<int:booking_id>")
-@jwt_required()
-def delete_booking(booking_id):
-    booking = Booking.query.get_or_404(booking_id)
-    current_user = get_jwt_identity()
-
-    if current_user != booking.customer.username:
-        return jsonify(error="Invalid authorization")
-
-    db.session.delete(booking)
-    db.session.commit()
 
-    return jsonify(deleted=f"Booking at {booking.address} deleted")
+    from auth_blueprint import auth
+    from booking_blueprint import bookings
+    from property_blueprint import properties
+    from user_blueprint import users
+
+    app = Flask(__name__)
+    CORS(app)
+
+    app.config["SQLALCHEMY_ECHO"] = os.environ.get("SQLALCHEMY_ECHO") == "1"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = False
+    app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    app.config["SQLALCHEMY_BINDS"] = db_routing.replica_binds(
+        [url for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",")
+         if url])
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "1") == "1",
+    }
+    app.config["DB_STICKY_SECONDS"] = int(
+        os.environ.get("DB_STICKY_SECONDS", 5))
+    app.config["CORS_HEADERS"] = "Content-Type"
+    app.config["SQL_PROFILER"] = os.environ.get("SQL_PROFILER", "1") == "1"
+    app.config["SQL_SLOW_QUERY_MS"] = int(
+        os.environ.get("SQL_SLOW_QUERY_MS", 200))
+    app.config["CACHE_BACKEND"] = os.environ.get("CACHE_BACKEND", "none")
+    app.config["CACHE_REDIS_URL"] = os.environ.get(
+        "CACHE_REDIS_URL", "redis://localhost:6379/0")
+    app.config["CACHE_TTL"] = int(os.environ.get("CACHE_TTL", 60))
+    app.config["CACHE_LOCAL_TTL"] = int(os.environ.get("CACHE_LOCAL_TTL", 5))
+    app.config["BOOKING_LOCK_MODE"] = os.environ.get(
+        "BOOKING_LOCK_MODE", "advisory")
+    app.config["BOOKING_LOCK_TIMEOUT_MS"] = int(
+        os.environ.get("BOOKING_LOCK_TIMEOUT_MS", 2000))
+    app.config["BOOKING_LOCK_RETRIES"] = int(
+        os.environ.get("BOOKING_LOCK_RETRIES", 3))
+
+    if test_config:
+        app.config.update(test_config)
+
+    connect_db(app)
+    db_routing.init_app(app)
+    sql_profiler.init_app(app)
+    cache.init_app(app)
+    booking_locks.init_app(app)
+    JWTManager(app)
+
+    app.register_blueprint(auth, url_prefix="/auth")
+    app.register_blueprint(users, url_prefix="/user")
+    app.register_blueprint(properties, url_prefix="/property")
+    app.register_blueprint(bookings, url_prefix="/bookings")
+
+    app.cli.add_command(bulk.bulk_cli)
+    app.cli.add_command(s3_gc.s3_cli)
+
+    return app
@@ -0,0 +1,330 @@
+"""ASGI entry point for SharenBn.
+
+    uvicorn asgi:app --workers 4
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+
+The hot public reads (GET /property, /property/available and
+/property/<id>) are served by async views on an async engine (asyncpg),
+so one process can keep hundreds of them waiting on Postgres at once.
+They share the Flask app's response cache (cache.py), and image URLs
+are signed off the event loop in a thread.
+
+Every other route, and any request those views leave alone (streaming,
+bad parameters, missing rows), falls through to the Flask app running
+in a thread pool, so routes, status codes and JSON shapes are the same
+in both modes.
+"""
+
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from werkzeug.http import http_date, quote_etag
+
+import cache
+import conditional
+import db_routing
+import streaming
+from app import create_app
+from models import Property
+from property_blueprint import (date_range, filter_criteria, int_arg,
+                                page_limit)
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",  # local development, if installed
+}
+ASYNC_DB_POOL_SIZE = int(os.environ.get("ASYNC_DB_POOL_SIZE", 20))
+WSGI_THREADS = int(os.environ.get("WSGI_THREADS", 20))
+
+
+def async_url(url):
+    """Return the async-driver form of a sync database URL."""
+
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+
+    url = make_url(url)
+    url = url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+    # asyncpg spells psycopg2's sslmode as ssl.
+    if "sslmode" in url.query:
+        url = (url.update_query_dict({"ssl": url.query["sslmode"]})
+               .difference_update_query(["sslmode"]))
+
+    return url
+
+
+def build_engines(config):
+    """Return (primary, replicas) async engines for a Flask app config."""
+
+    def engine(url):
+        url = async_url(url)
+        options = {"echo": config["SQLALCHEMY_ECHO"]}
+
+        # aiosqlite runs without a pool, so the pool settings are Postgres'.
+        if url.get_backend_name() == "postgresql":
+            options.update(config["SQLALCHEMY_ENGINE_OPTIONS"],
+                           pool_size=ASYNC_DB_POOL_SIZE)
+
+        return create_async_engine(url, **options)
+
+    primary = engine(config["SQLALCHEMY_DATABASE_URI"])
+    replicas = [engine(url)
+                for name, url in config["SQLALCHEMY_BINDS"].items()
+                if name.startswith(db_routing.REPLICA_PREFIX)]
+
+    return primary, replicas
+
+
+def primary_session(request):
+    """Return a session on the primary, for reads that fill the cache."""
+
+    primary, _ = request.app.state.engines
+    return AsyncSession(primary)
+
+
+def read_session(request):
+    """Return a session for reads, on a replica unless this client has
+    written recently (see db_routing).
+    """
+
+    primary, replicas = request.app.state.engines
+
+    try:
+        sticky = float(request.cookies.get(db_routing.STICKY_COOKIE, 0))
+    except ValueError:
+        sticky = 0
+
+    if replicas and sticky <= time.time():
+        return AsyncSession(random.choice(replicas))
+
+    return AsyncSession(primary)
+
+
+def json_response(request, payload, etag=None, last_modified=None):
+    """Encode `payload` exactly as Flask's jsonify does."""
+
+    flask_app = request.app.state.flask_app
+    body = flask_app.json.dumps(payload, separators=(",", ":")) + "\n"
+    response = Response(body, media_type=flask_app.json.mimetype)
+
+    return with_headers(response, etag, last_modified)
+
+
+def with_headers(response, etag=None, last_modified=None):
+    # Matches flask_cors' default of allowing every origin.
+    response.headers["Access-Control-Allow-Origin"] = "*"
+
+    if etag is not None:
+        response.headers["ETag"] = quote_etag(etag)
+    if last_modified is not None:
+        response.headers["Last-Modified"] = http_date(last_modified)
+
+    return response
+
+
+async def cached_json(request, key, build, etag, last_modified):
+    """Async form of cache.cached_json, on the Flask app's cache layers.
+
+    `build` is awaited on a miss. Cache I/O runs in a thread so a shared
+    backend round trip never blocks the event loop.
+    """
+
+    flask_app = request.app.state.flask_app
+    layers = flask_app.extensions["response_cache"]
+
+    if not layers["enabled"]:
+        return json_response(request, await build(), etag, last_modified)
+
+    body = await run_in_threadpool(cache.get_body, key, layers)
+    status = "HIT"
+
+    if body is None:
+        status = "MISS"
+        body = flask_app.json.dumps(await build()).encode()
+        await run_in_threadpool(cache.set_body, key, body, layers)
+
+    response = Response(body, media_type=flask_app.json.mimetype)
+    response.headers["X-Cache"] = status
+
+    return with_headers(response, etag, last_modified)
+
+
+def check(request, etag, updated_at):
+    return conditional.check(etag, updated_at,
+                             request.headers.get("if-none-match"),
+                             request.headers.get("if-modified-since"))
+
+
+async def page_after(session, criteria, cursor, limit):
+    """Async form of Property.page_after for a list of WHERE clauses."""
+
+    query = select(Property).where(*criteria)
+
+    if cursor is not None:
+        query = query.where(Property.id > cursor)
+
+    properties = (await session.scalars(
+        query.order_by(Property.id).limit(limit + 1))).all()
+
+    if len(properties) > limit:
+        properties = properties[:limit]
+        return properties, properties[-1].id
+
+    return properties, None
+
+
+async def list_properties(request):
+    """Async GET /property (not streamed)."""
+
+    args = request.query_params
+
+    if streaming.wants_stream(args):
+        return None
+
+    criteria = filter_criteria(args)
+    cursor = int_arg(args, "cursor")
+    limit = page_limit(args)
+
+    async with read_session(request) as session:
+        version = (await session.execute(
+            Property.version_query(criteria, cursor, limit))).one()
+        updated_at = version[-1]
+
+        etag = conditional.make_etag("properties",
+                                     request.scope["query_string"], *version)
+        fresh, last_modified = check(request, etag, updated_at)
+
+        if fresh:
+            return with_headers(Response(status_code=304), etag,
+                                last_modified)
+
+    async def build_page():
+        async with primary_session(request) as session:
+            properties, next_cursor = await page_after(
+                session, criteria, cursor, limit)
+
+        serialized = await run_in_threadpool(Property.serialize_many,
+                                             properties)
+        return {"properties": serialized, "next_cursor": next_cursor}
+
+    layers = request.app.state.flask_app.extensions["response_cache"]
+    key = await run_in_threadpool(cache.listing_key, args.multi_items(),
+                                  version, layers)
+
+    return await cached_json(request, key, build_page, etag, last_modified)
+
+
+async def list_available_properties(request):
+    """Async GET /property/available."""
+
+    args = request.query_params
+
+    try:
+        start_date, end_date = date_range(args)
+    except ValueError:
+        return None
+
+    criteria = [*filter_criteria(args),
+                Property.unbooked_criterion(start_date, end_date)]
+
+    async with read_session(request) as session:
+        properties, next_cursor = await page_after(
+            session, criteria, int_arg(args, "cursor"), page_limit(args))
+
+    serialized = await run_in_threadpool(Property.serialize_many, properties)
+
+    return json_response(
+        request, {"properties": serialized, "next_cursor": next_cursor})
+
+
+async def get_property(request):
+    """Async GET /property/<id>."""
+
+    property_id = request.path_params["property_id"]
+
+    async with read_session(request) as session:
+        updated_at = await session.scalar(
+            select(Property.updated_at).where(Property.id == property_id))
+
+        if updated_at is None:
+            return None
+
+        etag = conditional.make_etag("property", property_id, updated_at)
+        fresh, last_modified = check(request, etag, updated_at)
+
+        if fresh:
+            return with_headers(Response(status_code=304), etag,
+                                last_modified)
+
+    async def build_property():
+        async with primary_session(request) as session:
+            property = await session.get(Property, property_id)
+
+        return {"property": await run_in_threadpool(property.serialize)}
+
+    return await cached_json(request,
+                             cache.property_key(property_id, updated_at),
+                             build_property, etag, last_modified)
+
+
+class AsyncView():
+    """ASGI endpoint that tries an async handler for GETs and hands the
+    request to the Flask app when the handler returns None.
+    """
+
+    def __init__(self, handler, fallback):
+        self.handler = handler
+        self.fallback = fallback
+
+    async def __call__(self, scope, receive, send):
+        if scope["method"] == "GET":
+            response = await self.handler(Request(scope, receive))
+            if response is not None:
+                return await response(scope, receive, send)
+
+        await self.fallback(scope, receive, send)
+
+
+def create_asgi_app(flask_app=None):
+    """Create the ASGI app around a (new, by default) Flask app."""
+
+    flask_app = flask_app or create_app()
+    wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        app.state.engines = build_engines(flask_app.config)
+        yield
+        primary, replicas = app.state.engines
+        for engine in (primary, *replicas):
+            await engine.dispose()
+
+    app = Starlette(
+        routes=[
+            Route("/property", AsyncView(list_properties, wsgi)),
+            Route("/property/available",
+                  AsyncView(list_available_properties, wsgi)),
+            Route("/property/{property_id:int}",
+                  AsyncView(get_property, wsgi)),
+            Mount("/", app=wsgi),
+        ],
+        lifespan=lifespan,
+    )
+    app.state.flask_app = flask_app
+
+    return app
+
+
+app = create_asgi_app()
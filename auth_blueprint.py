@@ -1,15 +1,12 @@
-from flask import Flask, Blueprint, jsonify, g
-from flask_expects_json import expects_json
-from schemas import user_registration_schema
-from flask_jwt import JWT, jwt_required,jwt_encode_handler, current_identity
-from models import db, connect_db, User, Message, Like
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import create_access_token
 
-auth = Blueprint('auth', __name__)
+from models import User
 
+auth = Blueprint('auth', __name__)
 
 
-@auth.post("/")
-@expects_json(user_registration_schema)
+@auth.post("/signup")
 def register_user():
     """Handle user signup.
 
@@ -18,20 +15,42 @@ def register_user():
     If the there already is a user with that username: return JSON error
     """
 
-    username = g.data.get("username")
-    password = g.data.get("password")
-    first_name = g.data.get("first_name")
-    last_name = g.data.get("last_name")
-    email = g.data.get("email")
-
-    user = User.signup(username=username, password=password, first_name=first_name, last_name=last_name, email=email)
+    username = request.form.get("username")
+    password = request.form.get("password")
+    first_name = request.form.get("first_name")
+    last_name = request.form.get("last_name")
+    email = request.form.get("email")
+
+    user = User.signup(
+        username=username,
+        password=password,
+        first_name=first_name,
+        last_name=last_name,
+        email=email,
+    )
     if user:
         # Generate the JWT token with the username payload
-        payload = {'username': user.username}
-        token = jwt_encode_handler(payload)
-        return jsonify({'token': token.decode('utf-8')})
+        access_token = create_access_token(identity=user.username,
+                                           expires_delta=False)
+        return jsonify(access_token=access_token)
 
-    return jsonify({'message': 'Invalid credentials'}), 401
+    return jsonify({"error": "Invalid credentials"}), 401
 
 
+@auth.post("/login")
+def login_user():
+    """Handle user login.
+    Return JSON of JWT.
+    If Login with invalid credentials, return JSON: invalid.
+    """
+    username = request.form.get("username")
+    password = request.form.get("password")
+
+    user = User.authenticate(username, password)
+
+    if user:
+        access_token = create_access_token(identity=user.username,
+                                           expires_delta=False)
+        return jsonify(access_token=access_token)
 
+    return jsonify({"error": "Invalid credentials"}), 401
@@ -0,0 +1,179 @@
+"""Per-property availability cache for SharenBn.
+
+Each property's booked days are kept two ways: packed into a bitmap (a
+Python int) so a date-range check is a single mask-and-compare, and as a
+sorted interval index for listing the booked days in a window (the
+calendar). Both are cached in process.
+
+Every cached entry is tagged with the property's availability version,
+a counter in the shared cache backend (see cache.py) that invalidate()
+bumps whenever one of the property's bookings changes. Reads compare the
+tags, so a write in any worker retires every worker's copy at once.
+Without a shared backend (CACHE_BACKEND=none) nothing is cached.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import cache
+import db_routing
+
+AVAILABILITY_TTL = 300
+AVAILABILITY_MAX_ENTRIES = 50000
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+class DayBitmap():
+    """Booked days of one property.
+
+    Bit i is set when the day with ordinal `base + i` is booked. Booking
+    ranges are inclusive of both ends, matching Booking.verify_dates.
+    """
+
+    def __init__(self, ranges):
+        self.base = None
+        self.bits = 0
+
+        days = [(start.toordinal(), end.toordinal()) for start, end in ranges]
+
+        if days:
+            self.base = min(start for start, _ in days)
+            for start, end in days:
+                self.bits |= ((1 << (end - start + 1)) - 1) << (start - self.base)
+
+    def is_free(self, start_date, end_date):
+        """Return True if no day from start_date to end_date is booked."""
+
+        if not self.bits:
+            return True
+
+        start = max(start_date.toordinal(), self.base)
+        end = end_date.toordinal()
+
+        if end < start:
+            return True
+
+        mask = ((1 << (end - start + 1)) - 1) << (start - self.base)
+        return not (self.bits & mask)
+
+
+class IntervalIndex():
+    """Booked days of one property as sorted, merged day ranges.
+
+    Ranges are inclusive of both ends, like DayBitmap. Overlapping and
+    adjacent bookings are merged, so the ranges are disjoint and both
+    their starts and ends are sorted for bisection.
+    """
+
+    def __init__(self, ranges):
+        merged = []
+
+        for start, end in sorted((start.toordinal(), end.toordinal())
+                                 for start, end in ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+
+        self.starts = [start for start, _ in merged]
+        self.ends = [end for _, end in merged]
+
+    def booked(self, start_date, end_date):
+        """Return the booked (start, end) dates within the window, clipped
+        to it.
+        """
+
+        start = start_date.toordinal()
+        end = end_date.toordinal()
+        i = bisect_left(self.ends, start)
+        ranges = []
+
+        while i < len(self.starts) and self.starts[i] <= end:
+            ranges.append((date.fromordinal(max(self.starts[i], start)),
+                           date.fromordinal(min(self.ends[i], end))))
+            i += 1
+
+        return ranges
+
+    def days(self, start_date, end_date):
+        """Return [(date, booked)] for every day in the window."""
+
+        start = start_date.toordinal()
+        booked = [False] * (end_date.toordinal() - start + 1)
+
+        for first, last in self.booked(start_date, end_date):
+            for day in range(first.toordinal(), last.toordinal() + 1):
+                booked[day - start] = True
+
+        first_day = date.fromordinal(start)
+        return [(first_day + timedelta(days=i), is_booked)
+                for i, is_booked in enumerate(booked)]
+
+
+def version_key(property_id):
+    return f"availability:{property_id}"
+
+
+def _get_entry(property_id, load_ranges):
+    """Return the cached (bitmap, interval index) for a property.
+
+    On a miss, or when the property's shared version has moved on,
+    `load_ranges(property_id)` is called to fetch the property's
+    (start_date, end_date) pairs and both are rebuilt.
+    """
+
+    now = time.monotonic()
+    version = cache.get_version(version_key(property_id))
+
+    with _lock:
+        entry = _entries.get(property_id)
+        if entry and entry[0] > now and entry[1] == version:
+            _entries.move_to_end(property_id)
+            return entry[2]
+
+    # From the primary: a replica's lag would be cached with the entry.
+    with db_routing.primary():
+        ranges = load_ranges(property_id)
+    value = (DayBitmap(ranges), IntervalIndex(ranges))
+
+    # Don't store ranges that an invalidate() overtook while loading.
+    if (version is None
+            or cache.get_version(version_key(property_id)) != version):
+        return value
+
+    with _lock:
+        _entries[property_id] = (now + AVAILABILITY_TTL, version, value)
+        _entries.move_to_end(property_id)
+        while len(_entries) > AVAILABILITY_MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+    return value
+
+
+def get_bitmap(property_id, load_ranges):
+    """Return the cached DayBitmap for a property."""
+
+    return _get_entry(property_id, load_ranges)[0]
+
+
+def get_intervals(property_id, load_ranges):
+    """Return the cached IntervalIndex for a property."""
+
+    return _get_entry(property_id, load_ranges)[1]
+
+
+def invalidate(property_id):
+    """Drop every worker's cached availability for a property.
+
+    Call after the change is committed.
+    """
+
+    with _lock:
+        _entries.pop(property_id, None)
+
+    cache.bump_version(version_key(property_id))
@@ -1,46 +1,332 @@
 import os
-import boto3
-import botocore
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+from uuid import uuid4
+
 from dotenv import load_dotenv
+from werkzeug.utils import secure_filename
 
 load_dotenv()
 
-AWS_ACCESS_KEY = os.environ['AWS_ACCESS_KEY']
-AWS_SECRET_ACCESS_KEY = os.environ['AWS_SECRET_ACCESS_KEY']
+AWS_ACCESS_KEY = os.environ.get('AWS_ACCESS_KEY')
+AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
 AWS_BUCKET_NAME = os.environ['AWS_BUCKET_NAME']
+AWS_CDN_DOMAIN = os.environ.get('AWS_CDN_DOMAIN')
+AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')
+
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 20))
+S3_MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', 4))
+S3_CONNECT_TIMEOUT = 3
+S3_READ_TIMEOUT = 30
+
+FILE_URL_EXPIRATION = 24 * 60 * 60  # seconds a presigned image url is valid
+FILE_URL_EXPIRY_MARGIN = 5 * 60  # drop cached urls this long before expiry
+FILE_URL_CACHE_SIZE = 100000
+
+UPLOAD_PREFIX = 'uploads'
+UPLOAD_EXPIRATION = 900  # seconds a presigned upload stays valid
+MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+MAX_MULTIPART_PARTS = 10000
+
+# complete_multipart_upload errors caused by the request, not by S3
+MULTIPART_CLIENT_ERRORS = {'NoSuchUpload', 'InvalidPart', 'InvalidPartOrder',
+                           'EntityTooSmall', 'MalformedXML',
+                           'InvalidArgument'}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+_url_cache = OrderedDict()
+_url_lock = threading.Lock()
+
+
+def get_s3_client():
+    """Return this process's S3 client, creating it on first use.
+
+    boto3 is imported lazily to keep startup fast, and each forked worker
+    builds its own client (and connection pool) instead of inheriting the
+    parent's. Clients are thread-safe, so one per process is enough.
+    """
+
+    pid = os.getpid()
+    client = _clients.get(pid)
 
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(pid)
+            if client is None:
+                import boto3
+                from botocore.config import Config
+
+                client = boto3.session.Session().client(
+                    's3',
+                    aws_access_key_id=AWS_ACCESS_KEY,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                    endpoint_url=AWS_S3_ENDPOINT_URL,
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        connect_timeout=S3_CONNECT_TIMEOUT,
+                        read_timeout=S3_READ_TIMEOUT,
+                        retries={'max_attempts': S3_MAX_ATTEMPTS,
+                                 'mode': 'standard'},
+                    ),
+                )
+                _clients.clear()
+                _clients[pid] = client
+
+    return client
 
-# Initialize AWS S3 client
-s3 = boto3.client('s3',
-                  aws_access_key_id=AWS_ACCESS_KEY,
-                  aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
 
 class Aws():
     """Class for AWS methods"""
 
     @classmethod
     def get_file_url(cls, file_name):
-        try:
-            # Generate a pre-signed URL for the file
-            url = s3.generate_presigned_url('get_object',
-                                            Params={'Bucket': AWS_BUCKET_NAME,
-                                                    'Key': file_name}
-                                                    )  # URL expiration time in seconds (7 days)
-
-            # Return the URL as a JSON response
-            return url
-        except botocore.exceptions.NoCredentialsError:
-            return 'Error: AWS credentials not found.', 500
-        except botocore.exceptions.ParamValidationError:
-            return 'Error: Invalid bucket or file name.', 400
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchKey':
-                return 'Error: File not found.', 404
-            else:
-                return 'Error: Failed to retrieve file URL.', 500
-
-    @classmethod
-    def upload_file(cls, file):
-        file_name = file.filename
-        s3.upload_fileobj(file, AWS_BUCKET_NAME, file_name,ExtraArgs={'ContentType': "image/jpeg"})
+        """Return a URL for the object stored under `file_name`."""
+
+        return cls.get_file_urls([file_name])[file_name]
+
+    @classmethod
+    def get_file_urls(cls, file_names):
+        """Return {key: url} for many object keys at once.
+
+        URLs come from AWS_CDN_DOMAIN when set, otherwise they are
+        presigned. Presigned URLs are cached until shortly before their
+        signatures expire, so only keys missing from the cache are signed.
+        """
+
+        urls = {}
+
+        if AWS_CDN_DOMAIN:
+            for key in file_names:
+                urls[key] = f'https://{AWS_CDN_DOMAIN}/{quote(key)}'
+            return urls
+
+        now = time.monotonic()
+        missing = []
+
+        with _url_lock:
+            for key in file_names:
+                entry = _url_cache.get(key)
+                if entry and entry[0] > now:
+                    urls[key] = entry[1]
+                elif key not in urls:
+                    missing.append(key)
+
+        s3 = get_s3_client()
+        signed = {
+            key: s3.generate_presigned_url('get_object',
+                                           Params={'Bucket': AWS_BUCKET_NAME,
+                                                   'Key': key},
+                                           ExpiresIn=FILE_URL_EXPIRATION)
+            for key in missing
+        }
+
+        if signed:
+            expires_at = now + FILE_URL_EXPIRATION - FILE_URL_EXPIRY_MARGIN
+            with _url_lock:
+                for key, url in signed.items():
+                    _url_cache[key] = (expires_at, url)
+                    _url_cache.move_to_end(key)
+                while len(_url_cache) > FILE_URL_CACHE_SIZE:
+                    _url_cache.popitem(last=False)
+
+        urls.update(signed)
+        return urls
+
+    @classmethod
+    def upload_file(cls, file, username):
+        """Upload a werkzeug FileStorage under a fresh per-user key."""
+
+        s3 = get_s3_client()
+        file_name = cls.new_upload_key(username, file.filename)
+        s3.upload_fileobj(file, AWS_BUCKET_NAME, file_name,
+                          ExtraArgs={'ContentType': file.mimetype
+                                     or 'application/octet-stream'})
         return file_name
+
+    @classmethod
+    def get_file(cls, key, max_size=None):
+        """Return the bytes stored under `key`.
+
+        With `max_size`, raises ValueError instead of reading an object
+        larger than that.
+        """
+
+        s3 = get_s3_client()
+        obj = s3.get_object(Bucket=AWS_BUCKET_NAME, Key=key)
+
+        if max_size is None:
+            return obj['Body'].read()
+
+        if obj['ContentLength'] > max_size:
+            obj['Body'].close()
+            raise ValueError(f'{key} is larger than {max_size} bytes')
+
+        data = obj['Body'].read(max_size + 1)
+        obj['Body'].close()
+        if len(data) > max_size:
+            raise ValueError(f'{key} is larger than {max_size} bytes')
+
+        return data
+
+    @classmethod
+    def put_file(cls, key, data, content_type):
+        """Store immutable bytes under a content-addressed `key`."""
+
+        s3 = get_s3_client()
+        s3.put_object(Bucket=AWS_BUCKET_NAME,
+                      Key=key,
+                      Body=data,
+                      ContentType=content_type,
+                      CacheControl='public, max-age=31536000, immutable')
+
+    @classmethod
+    def new_upload_key(cls, username, file_name):
+        """Return a fresh object key for a user's direct upload."""
+
+        file_name = secure_filename(file_name or '') or 'image'
+        return f'{UPLOAD_PREFIX}/{username}/{uuid4().hex}-{file_name}'
+
+    @classmethod
+    def is_user_upload(cls, key, username):
+        """Return True if `key` was issued to `username` by new_upload_key."""
+
+        return bool(key) and key.startswith(f'{UPLOAD_PREFIX}/{username}/')
+
+    @classmethod
+    def get_upload_post(cls, key, content_type):
+        """Return presigned POST url and form fields for a direct upload.
+
+        The client POSTs the fields plus the file straight to S3; the
+        policy pins the key and content type and caps the size.
+        """
+
+        s3 = get_s3_client()
+        return s3.generate_presigned_post(
+            AWS_BUCKET_NAME,
+            key,
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', 1, MAX_UPLOAD_SIZE],
+            ],
+            ExpiresIn=UPLOAD_EXPIRATION,
+        )
+
+    @classmethod
+    def start_multipart_upload(cls, key, content_type, part_count):
+        """Start a multipart upload and presign a PUT url for each part.
+
+        Returns (upload_id, part_urls); part N goes to part_urls[N - 1].
+        """
+
+        s3 = get_s3_client()
+        upload = s3.create_multipart_upload(Bucket=AWS_BUCKET_NAME,
+                                            Key=key,
+                                            ContentType=content_type)
+        upload_id = upload['UploadId']
+
+        part_urls = [
+            s3.generate_presigned_url('upload_part',
+                                      Params={'Bucket': AWS_BUCKET_NAME,
+                                              'Key': key,
+                                              'UploadId': upload_id,
+                                              'PartNumber': part_number},
+                                      ExpiresIn=UPLOAD_EXPIRATION)
+            for part_number in range(1, part_count + 1)
+        ]
+
+        return upload_id, part_urls
+
+    @classmethod
+    def complete_multipart_upload(cls, key, upload_id, parts):
+        """Finish a multipart upload.
+
+        `parts` is a list of {"PartNumber", "ETag"} as returned by S3 for
+        each part PUT. Raises ValueError if S3 rejects the upload id or
+        parts (unknown, expired, or out of order).
+        """
+
+        from botocore.exceptions import ClientError, ParamValidationError
+
+        try:
+            parts = sorted(
+                ({'PartNumber': int(p['PartNumber']), 'ETag': str(p['ETag'])}
+                 for p in parts),
+                key=lambda p: p['PartNumber'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Each part needs a PartNumber and an ETag')
+
+        s3 = get_s3_client()
+        try:
+            s3.complete_multipart_upload(
+                Bucket=AWS_BUCKET_NAME,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts},
+            )
+        except ParamValidationError as e:
+            raise ValueError(f'Invalid multipart upload: {e}')
+        except ClientError as e:
+            if e.response['Error']['Code'] not in MULTIPART_CLIENT_ERRORS:
+                raise
+            raise ValueError(
+                f"Could not complete upload: {e.response['Error']['Code']}")
+
+    @classmethod
+    def file_size(cls, key):
+        """Return the size in bytes of the object under `key`, or None if
+        there is none.
+        """
+
+        from botocore.exceptions import ClientError
+
+        s3 = get_s3_client()
+        try:
+            return s3.head_object(Bucket=AWS_BUCKET_NAME,
+                                  Key=key)['ContentLength']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+
+    @classmethod
+    def file_exists(cls, key):
+        """Return True if an object is stored under `key`."""
+
+        return cls.file_size(key) is not None
+
+    @classmethod
+    def list_files(cls, prefix, delimiter=None):
+        """Yield {"Key", "LastModified", "Size", ...} for every object
+        under `prefix`, one listing page at a time.
+
+        With `delimiter` ('/'), objects in "subdirectories" of `prefix`
+        are left out.
+        """
+
+        s3 = get_s3_client()
+        options = {'Delimiter': delimiter} if delimiter else {}
+        pages = s3.get_paginator('list_objects_v2').paginate(
+            Bucket=AWS_BUCKET_NAME, Prefix=prefix, **options)
+
+        for page in pages:
+            yield from page.get('Contents', [])
+
+    @classmethod
+    def delete_files(cls, keys):
+        """Delete up to 1000 objects in one request.
+
+        Returns the {"Key", "Code", "Message"} errors S3 reported.
+        """
+
+        s3 = get_s3_client()
+        response = s3.delete_objects(
+            Bucket=AWS_BUCKET_NAME,
+            Delete={'Objects': [{'Key': key} for key in keys],
+                    'Quiet': True})
+
+        return response.get('Errors', [])
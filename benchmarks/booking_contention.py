@@ -0,0 +1,164 @@
+"""Booking contention benchmark.
+
+Hammers one hot property with concurrent POST /property/<id>/bookings
+requests from several processes, then reports successful bookings per
+second and checks that no two committed bookings overlap. Point
+DATABASE_URL at a scratch Postgres database; the locks are no-ops
+elsewhere.
+
+    python benchmarks/booking_contention.py --processes 8 --requests 200
+    python benchmarks/booking_contention.py --lock-mode none   # expect overlaps
+
+The benchmark creates its own owner, guest and property, and deletes
+them afterwards unless --keep is given. Exits non-zero if any overlap
+was committed.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import date, timedelta
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+OVERLAPS_SQL = """
+    SELECT count(*)
+    FROM bookings a
+    JOIN bookings b
+      ON a.property_id = b.property_id
+     AND a.id < b.id
+     AND a.start_date <= b.end_date
+     AND a.end_date >= b.start_date
+    WHERE a.property_id = :property_id
+"""
+
+
+def make_app():
+    # Imported here so each spawned worker builds its own app and pool.
+    from app import create_app
+
+    return create_app({"SQL_PROFILER": False, "CACHE_BACKEND": "none"})
+
+
+def setup(tag):
+    """Create the owner, guest and hot property; return the property id."""
+
+    from models import db, User, Property
+
+    owner = User(username=f"own-{tag}", email=f"own-{tag}@example.com",
+                 password="x", first_name="Bench", last_name="Owner")
+    guest = User(username=f"gst-{tag}", email=f"gst-{tag}@example.com",
+                 password="x", first_name="Bench", last_name="Guest")
+    db.session.add_all([owner, guest])
+    property = Property(address=f"Benchmark {tag}", price_rate=100,
+                        owner=owner, sqft=500, img_key="benchmark",
+                        description="Booking contention benchmark")
+    db.session.add(property)
+    db.session.commit()
+
+    return property.id
+
+
+def worker(args):
+    """Send `requests` booking attempts; return a Counter of outcomes."""
+
+    property_id, guest, requests, window_days, seed = args
+    from flask_jwt_extended import create_access_token
+
+    app = make_app()
+    rng = random.Random(seed)
+    outcomes = Counter()
+
+    with app.app_context():
+        headers = {"Authorization": f"Bearer {create_access_token(guest)}"}
+
+    client = app.test_client()
+    first_day = date(2030, 1, 1)
+
+    for _ in range(requests):
+        start = first_day + timedelta(days=rng.randrange(window_days))
+        end = start + timedelta(days=rng.randint(1, 4))
+        response = client.post(
+            f"/property/{property_id}/bookings",
+            data={"start_date": start.isoformat(),
+                  "end_date": end.isoformat()},
+            headers=headers)
+        body = response.get_json(silent=True) or {}
+
+        if "booking" in body:
+            outcomes["booked"] += 1
+        elif response.status_code == 409:
+            outcomes["busy"] += 1
+        elif body.get("error") == "Dates are already booked.":
+            outcomes["conflict"] += 1
+        else:
+            outcomes["error"] += 1
+
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--requests", type=int, default=200,
+                        help="booking attempts per process")
+    parser.add_argument("--window-days", type=int, default=365,
+                        help="days the random stays are drawn from")
+    parser.add_argument("--lock-mode", choices=["advisory", "row", "none"])
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the benchmark rows afterwards")
+    args = parser.parse_args()
+
+    if args.lock_mode:
+        os.environ["BOOKING_LOCK_MODE"] = args.lock_mode
+
+    from sqlalchemy import text
+    from models import db, User, Property, Booking
+
+    app = make_app()
+    tag = uuid.uuid4().hex[:8]
+
+    with app.app_context():
+        property_id = setup(tag)
+
+    jobs = [(property_id, f"gst-{tag}", args.requests, args.window_days, i)
+            for i in range(args.processes)]
+
+    start = time.perf_counter()
+    with get_context("spawn").Pool(args.processes) as pool:
+        outcomes = sum(pool.map(worker, jobs), Counter())
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        overlaps = db.session.execute(
+            text(OVERLAPS_SQL), {"property_id": property_id}).scalar()
+        mode = app.config["BOOKING_LOCK_MODE"]
+        dialect = db.engine.dialect.name
+
+        if not args.keep:
+            db.session.execute(db.delete(Booking).where(
+                Booking.property_id == property_id))
+            db.session.execute(db.delete(Property).where(
+                Property.id == property_id))
+            db.session.execute(db.delete(User).where(
+                User.username.in_([f"own-{tag}", f"gst-{tag}"])))
+            db.session.commit()
+
+    attempts = sum(outcomes.values())
+    print(f"lock mode {mode} on {dialect}, {args.processes} processes, "
+          f"{attempts} attempts in {elapsed:.2f}s")
+    print(f"{outcomes['booked']} booked ({outcomes['booked'] / elapsed:.1f} "
+          f"bookings/sec), {outcomes['conflict']} conflicts, "
+          f"{outcomes['busy']} busy, {outcomes['error']} errors")
+    print(f"{overlaps} overlapping bookings committed")
+
+    sys.exit(1 if overlaps else 0)
+
+
+if __name__ == "__main__":
+    main()
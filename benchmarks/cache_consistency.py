@@ -0,0 +1,108 @@
+"""Response cache consistency check across workers.
+
+Builds two apps that share one cache backend, as two gunicorn workers
+sharing Redis do, warms both workers' local layers with GET /property/<id>
+and a GET /property page, edits the property through the first worker and
+reads it back through the second. Every response must carry the body its
+ETag was made from: a stale local copy served under the new ETag would
+let clients revalidate the old price with 304s until it expired.
+
+    python benchmarks/cache_consistency.py
+
+Point DATABASE_URL at a scratch database (sqlite is fine) and set the
+AWS_* variables the app needs to sign image URLs; nothing is sent to S3.
+The check creates its own owner and property and deletes them afterwards.
+Exits non-zero if any response is inconsistent.
+"""
+
+import argparse
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_apps():
+    from app import create_app
+
+    config = {"SQL_PROFILER": False, "CACHE_BACKEND": "memory"}
+    first, second = create_app(config), create_app(config)
+
+    # One backend for both, as a shared Redis would be.
+    second.extensions["response_cache"]["shared"] = (
+        first.extensions["response_cache"]["shared"])
+
+    return first, second
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--edits", type=int, default=5)
+    args = parser.parse_args()
+
+    from flask_jwt_extended import create_access_token
+    from models import db, User, Property
+
+    first, second = make_apps()
+    tag = uuid.uuid4().hex[:8]
+
+    with first.app_context():
+        db.create_all()
+        owner = User(username=f"own-{tag}", email=f"own-{tag}@example.com",
+                     password="x", first_name="Cache", last_name="Owner")
+        property = Property(address=f"Cache check {tag}", price_rate=100,
+                            owner=owner, sqft=500, img_key="benchmark",
+                            description="Response cache consistency check")
+        db.session.add_all([owner, property])
+        db.session.commit()
+        property_id = property.id
+        headers = {"Authorization":
+                   f"Bearer {create_access_token(owner.username)}"}
+
+    writer, reader = first.test_client(), second.test_client()
+    urls = [f"/property/{property_id}", f"/property?owner=own-{tag}"]
+    failures = []
+
+    def check(client, url, price_rate):
+        response = client.get(url)
+        body = response.get_json()
+        rows = body.get("properties") or [body.get("property")]
+        etag = response.headers["ETag"]
+
+        if rows[0]["price_rate"] != price_rate:
+            failures.append(f"{url}: price_rate {rows[0]['price_rate']} "
+                            f"under {etag}, expected {price_rate}")
+
+        revalidated = client.get(url, headers={"If-None-Match": etag})
+        if revalidated.status_code != 304:
+            failures.append(f"{url}: {revalidated.status_code} for its own "
+                            f"ETag {etag}")
+
+    for price_rate in range(101, 101 + args.edits):
+        for url in urls:
+            for client in (writer, reader):
+                check(client, url, price_rate - 1)
+
+        writer.patch(f"/property/{property_id}",
+                     data={"price_rate": price_rate}, headers=headers)
+
+        for url in urls:
+            check(reader, url, price_rate)
+
+    with first.app_context():
+        db.session.execute(db.delete(Property).where(
+            Property.id == property_id))
+        db.session.execute(db.delete(User).where(
+            User.username == f"own-{tag}"))
+        db.session.commit()
+
+    for failure in failures[:10]:
+        print(f"  {failure}")
+    print(f"{args.edits} edits, {len(failures)} inconsistent responses")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Login throughput benchmark.
+
+Measures how many password checks per second one process sustains for a
+given bcrypt cost and executor, or how many logins per second a running
+server answers. Use it to size gunicorn workers and BCRYPT_WORKERS.
+
+    python benchmarks/login_throughput.py --rounds 12 --concurrency 8
+    BCRYPT_EXECUTOR=thread python benchmarks/login_throughput.py
+    python benchmarks/login_throughput.py --url http://localhost:5001 \\
+        --username testyzesty1 --password password
+"""
+
+import argparse
+import os
+import sys
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import passwords  # noqa: E402
+
+
+def check_locally(pw_hash, password):
+    return passwords.check_password(pw_hash, password)
+
+
+def login_over_http(url, username, password):
+    data = urllib.parse.urlencode(
+        {'username': username, 'password': password}).encode()
+    with urllib.request.urlopen(f'{url}/auth/login', data=data) as response:
+        return response.status == 200
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=os.cpu_count())
+    parser.add_argument('--rounds', type=int,
+                        default=passwords.BCRYPT_LOG_ROUNDS)
+    parser.add_argument('--url', help='benchmark a running server instead')
+    parser.add_argument('--username', default='testyzesty1')
+    parser.add_argument('--password', default='password')
+    args = parser.parse_args()
+
+    if args.url:
+        target = 'POST /auth/login'
+
+        def attempt(_):
+            return login_over_http(args.url, args.username, args.password)
+    else:
+        target = (f'check_password rounds={args.rounds} '
+                  f'executor={passwords.BCRYPT_EXECUTOR} '
+                  f'workers={passwords.BCRYPT_WORKERS}')
+        pw_hash = passwords.hash_password(args.password, args.rounds)
+
+        def attempt(_):
+            return check_locally(pw_hash, args.password)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(attempt, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    print(target)
+    print(f'{args.requests} logins, concurrency {args.concurrency}: '
+          f'{elapsed:.2f}s, {args.requests / elapsed:.1f} logins/sec, '
+          f'{sum(results)} succeeded')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Batch pricing benchmark and consistency check.
+
+Prices random stays on random pricing rules with pricing.quote_many in
+one batch and with pricing.quote one at a time, reports both rates, and
+checks that every stay gets the same total either way: the price shown
+by POST /property/quotes must be what a booking is charged.
+
+    python benchmarks/quote_consistency.py --stays 6000 --seed 1
+
+Needs no database. Exits non-zero if any quote differs.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pricing  # noqa: E402
+
+
+def random_rules(rng):
+    def month_day():
+        return f"{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+    return pricing.parse_rules({
+        "weekday_multipliers": [round(rng.uniform(0.7, 1.6), 3)
+                                for _ in range(7)],
+        "seasons": [{"start": month_day(), "end": month_day(),
+                     "multiplier": round(rng.uniform(0.5, 2.5), 3)}
+                    for _ in range(rng.randint(0, 4))],
+        "weekly_discount": round(rng.uniform(0, 0.3), 3),
+        "monthly_discount": round(rng.uniform(0, 0.5), 3),
+    })
+
+
+def random_stays(rng, count, property_count):
+    properties = [SimpleNamespace(id=i, price_rate=rng.randint(20, 900),
+                                  pricing=random_rules(rng))
+                  for i in range(property_count)]
+    first_day = date(2026, 1, 1)
+    stays = []
+
+    for _ in range(count):
+        start = first_day + timedelta(days=rng.randrange(1200))
+        end = start + timedelta(days=rng.randint(1, 60))
+        stays.append((rng.choice(properties), start, end))
+
+    return stays
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stays", type=int, default=6000)
+    parser.add_argument("--properties", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stays = random_stays(random.Random(args.seed), args.stays,
+                         args.properties)
+
+    start = time.perf_counter()
+    batched = pricing.quote_many(stays)
+    batch_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single = [pricing.quote(*stay) for stay in stays]
+    single_elapsed = time.perf_counter() - start
+
+    mismatches = [(stay, a, b) for stay, a, b in zip(stays, batched, single)
+                  if a != b]
+
+    print(f"{len(stays)} stays: batch {len(stays) / batch_elapsed:,.0f} "
+          f"quotes/sec, one at a time {len(stays) / single_elapsed:,.0f} "
+          f"quotes/sec")
+    for (property, start_date, end_date), a, b in mismatches[:10]:
+        print(f"  rate {property.price_rate}, {start_date} to {end_date}: "
+              f"batch {a}, single {b}")
+    print(f"{len(mismatches)} quotes differ")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import get_jwt_identity, jwt_required
+
+import availability
+import booking_locks
+import conditional
+import pricing
+from models import db, Booking, Property, MAX_STAY_DAYS, TIME_FORMAT
+from property_blueprint import MAX_QUOTE_SPAN_DAYS
+
+bookings = Blueprint('bookings', __name__)
+
+MAX_BATCH_BOOKINGS = 100
+
+
+def parse_batch_item(item):
+    """Return (property_id, start_date, end_date) for one batch item.
+
+    Raises ValueError with a message for the item's result.
+    """
+
+    try:
+        property_id = int(item["property_id"])
+        start_date = datetime.strptime(item["start_date"], TIME_FORMAT)
+        end_date = datetime.strptime(item["end_date"], TIME_FORMAT)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("property_id, start_date and end_date "
+                         "(YYYY-MM-DD) are required")
+
+    if start_date > end_date:
+        raise ValueError("Start date is after end date.")
+
+    if (end_date - start_date).days > MAX_STAY_DAYS:
+        raise ValueError(f"Stays are limited to {MAX_STAY_DAYS} days.")
+
+    return property_id, start_date, end_date
+
+
+@bookings.post("/batch")
+@jwt_required()
+def book_batch():
+    """Book many stays in one transaction
+
+    JSON body: {bookings: [{property_id, start_date, end_date}, ...],
+                all_or_nothing: true}
+    With all_or_nothing (the default) nothing is booked unless every item
+    can be; otherwise the valid items are booked and the rest reported.
+    All dates must fall within MAX_QUOTE_SPAN_DAYS of each other, as for
+    POST /property/quotes, since the batch is priced in one array.
+
+    Return JSON with one result per item, in order: 201 if anything was
+    booked, 409 if nothing was
+    """
+
+    current_user = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    items = data.get("bookings")
+    all_or_nothing = data.get("all_or_nothing", True)
+
+    if not isinstance(items, list) or not 1 <= len(items) <= MAX_BATCH_BOOKINGS:
+        return jsonify({"error": "bookings must list 1 to "
+                                 f"{MAX_BATCH_BOOKINGS} stays"}), 400
+
+    if not isinstance(all_or_nothing, bool):
+        return jsonify({"error": "all_or_nothing must be true or false"}), 400
+
+    errors = {}
+    stays = {}
+
+    for i, item in enumerate(items):
+        try:
+            stays[i] = parse_batch_item(item)
+        except ValueError as e:
+            errors[i] = str(e)
+
+    if stays:
+        span = (max(end for _, _, end in stays.values())
+                - min(start for _, start, _ in stays.values())).days
+        if span > MAX_QUOTE_SPAN_DAYS:
+            return jsonify({"error": "Booked dates span too long"}), 400
+
+    properties = {
+        property.id: property
+        for property in Property.query.filter(
+            Property.id.in_({stay[0] for stay in stays.values()}))
+    }
+
+    for i, (property_id, _, _) in stays.items():
+        if property_id not in properties:
+            errors[i] = "Property not found"
+        elif properties[property_id].user == current_user:
+            errors[i] = "Owner cannot book own property"
+
+    candidates = [i for i in stays if i not in errors]
+
+    def write():
+        failed = dict(errors)
+
+        # Conflicts with existing bookings: one query for the whole batch.
+        for n in Booking.batch_conflicts([stays[i] for i in candidates]):
+            failed[candidates[n]] = "Dates are already booked."
+
+        # Conflicts within the batch: earlier items win.
+        accepted = {}
+        for i in candidates:
+            if i in failed:
+                continue
+
+            property_id, start_date, end_date = stays[i]
+            if any(start_date <= other_end and end_date >= other_start
+                   for other_start, other_end in accepted.get(property_id, [])):
+                failed[i] = "Dates overlap another booking in this batch."
+            else:
+                accepted.setdefault(property_id, []).append(
+                    (start_date, end_date))
+
+        to_book = [] if failed and all_or_nothing else [
+            i for i in candidates if i not in failed]
+
+        prices = pricing.quote_many([(properties[stays[i][0]], stays[i][1],
+                                      stays[i][2]) for i in to_book])
+        booked = {}
+
+        for i, total_price in zip(to_book, prices):
+            property_id, start_date, end_date = stays[i]
+            booked[i] = Booking(
+                property=properties[property_id],
+                username=current_user,
+                total_price=total_price,
+                start_date=start_date,
+                end_date=end_date,
+            )
+
+        serialized = {}
+
+        if booked:
+            db.session.add_all(booked.values())
+            # Serialize before the commit expires every row we just built.
+            db.session.flush()
+            serialized = dict(zip(booked,
+                                  Booking.serialize_many(booked.values())))
+            db.session.commit()
+
+        return failed, booked, serialized
+
+    try:
+        errors, booked, serialized = booking_locks.run_locked(
+            [stays[i][0] for i in candidates], write)
+    except booking_locks.PropertyBusy:
+        return jsonify({"error": "Properties are busy, try again."}), 409
+
+    for property_id in {stays[i][0] for i in booked}:
+        availability.invalidate(property_id)
+
+    results = []
+
+    for i, item in enumerate(items):
+        result = {"index": i}
+        if i in booked:
+            result.update(status="booked", booking=serialized[i])
+        else:
+            result.update(status="failed",
+                          error=errors.get(i, "Not booked, batch failed"))
+        results.append(result)
+
+    return jsonify(results=results), (201 if booked else 409)
+
+
+@bookings.get("/<int:booking_id>")
+@jwt_required()
+def get_booking(booking_id):
+    """Given a booking id
+    Return JSON of the booking
+    """
+    current_user = get_jwt_identity()
+    booking = Booking.with_property().filter_by(id=booking_id).first_or_404()
+    property = booking.property
+
+    if (current_user != booking.username) and (property.user != current_user):
+        return jsonify({"error": "Invalid Authorization"})
+
+    updated_at = max(booking.updated_at, property.updated_at)
+    etag = conditional.make_etag("booking", booking.id, booking.updated_at,
+                                 property.updated_at)
+
+    return conditional.respond(etag, updated_at,
+                               lambda: jsonify(booking=booking.serialize()))
+
+
+@bookings.patch("/<int:booking_id>")
+@jwt_required()
+def update_booking(booking_id):
+    """Given a property id
+    Update the booking in the database
+    Return JSON of all the updated property booking
+    """
+    booking = Booking.with_property().filter_by(id=booking_id).first_or_404()
+    property = booking.property
+
+    start_date_str = request.form.get("start_date",
+                                      datetime.strftime(booking.start_date,
+                                                        TIME_FORMAT))
+    end_date_str = request.form.get("end_date",
+                                    datetime.strftime(booking.end_date,
+                                                      TIME_FORMAT))
+
+    start_date = datetime.strptime(start_date_str, TIME_FORMAT)
+    end_date = datetime.strptime(end_date_str, TIME_FORMAT)
+    current_user = get_jwt_identity()
+
+    if current_user != booking.username:
+        return jsonify({"error": "Invalid Authorization"})
+
+    if (end_date - start_date).days > MAX_STAY_DAYS:
+        return jsonify({"error": f"Stays are limited to {MAX_STAY_DAYS} "
+                                 "days."}), 400
+
+    def write():
+        Booking.verify_dates(start_date=start_date,
+                             end_date=end_date,
+                             property_id=property.id,
+                             booking_id=booking_id)
+
+        booking.start_date = start_date
+        booking.end_date = end_date
+        booking.total_price = pricing.quote(property, start_date, end_date)
+        db.session.commit()
+
+    try:
+        booking_locks.run_locked([property.id], write)
+        availability.invalidate(property.id)
+        return jsonify(booking=booking.serialize())
+    except ValueError:
+        return jsonify({"error":'Start date is after end date.'}), 500
+        # return jsonify(error="start date is after end date")
+    except MemoryError:
+        return jsonify({"error":'Dates are already booked.'}), 500
+        # return jsonify(error="dates are already booked")
+    except booking_locks.PropertyBusy:
+        return jsonify({"error": "Property is busy, try again."}), 409
+
+
+@bookings.delete("/<int:booking_id>")
+@jwt_required()
+def delete_booking(booking_id):
+    booking = Booking.with_property().filter_by(id=booking_id).first_or_404()
+    current_user = get_jwt_identity()
+
+    if current_user != booking.username:
+        return jsonify(error="Invalid authorization")
+
+    property_id = booking.property_id
+
+    db.session.delete(booking)
+    db.session.commit()
+    availability.invalidate(property_id)
+
+    return jsonify(deleted=f"Booking at {booking.property.address} deleted")
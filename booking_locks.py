@@ -0,0 +1,111 @@
+"""Per-property locking for booking writes.
+
+Checking a booking for overlaps and inserting it are two statements, so
+two concurrent requests can both pass the check and double-book. Writers
+serialize per property instead, holding the lock until their transaction
+ends. BOOKING_LOCK_MODE picks how:
+
+    advisory  pg_advisory_xact_lock on the property id (the default);
+              nothing else contends for it
+    row       SELECT ... FOR UPDATE on the property row, which also waits
+              for edits to the listing
+    none      no locking
+
+Locks are Postgres-only; other databases run as "none". Waits are capped
+at BOOKING_LOCK_TIMEOUT_MS, and timed-out or deadlocked attempts are
+retried up to BOOKING_LOCK_RETRIES times with jittered backoff.
+"""
+
+import random
+import time
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from models import db, Property
+
+# First key of the two-key advisory lock, so booking locks can't collide
+# with other advisory lock users.
+ADVISORY_NAMESPACE = 7401
+RETRY_BACKOFF_SECONDS = 0.05
+
+# lock_not_available, deadlock_detected, serialization_failure
+RETRYABLE_PGCODES = {"55P03", "40P01", "40001"}
+
+
+class PropertyBusy(Exception):
+    """The property stayed locked through every retry."""
+
+
+def init_app(app):
+    app.config.setdefault("BOOKING_LOCK_MODE", "advisory")
+    app.config.setdefault("BOOKING_LOCK_TIMEOUT_MS", 2000)
+    app.config.setdefault("BOOKING_LOCK_RETRIES", 3)
+
+    if app.config["BOOKING_LOCK_MODE"] not in ("advisory", "row", "none"):
+        raise ValueError(
+            f"Unknown BOOKING_LOCK_MODE: {app.config['BOOKING_LOCK_MODE']}")
+
+
+def _mode():
+    if db.engine.dialect.name != "postgresql":
+        return "none"
+
+    return current_app.config["BOOKING_LOCK_MODE"]
+
+
+def lock_properties(property_ids):
+    """Take the booking locks on properties for this transaction.
+
+    Locks are taken in id order so batches can't deadlock each other.
+    """
+
+    mode = _mode()
+
+    if mode == "none":
+        return
+
+    timeout = int(current_app.config["BOOKING_LOCK_TIMEOUT_MS"])
+    db.session.execute(text(f"SET LOCAL lock_timeout = {timeout}"))
+
+    for property_id in sorted(set(property_ids)):
+        if mode == "advisory":
+            db.session.execute(db.select(
+                db.func.pg_advisory_xact_lock(ADVISORY_NAMESPACE,
+                                              property_id)))
+        else:
+            db.session.execute(
+                db.select(Property.id)
+                .where(Property.id == property_id)
+                .with_for_update())
+
+
+def _is_retryable(error):
+    return getattr(error.orig, "pgcode", None) in RETRYABLE_PGCODES
+
+
+def run_locked(property_ids, write):
+    """Call write() holding the booking locks on `property_ids`.
+
+    write() must do all of its reads and writes, and commit, itself: a
+    failed attempt is rolled back and write() is called again from
+    scratch. Raises PropertyBusy once the retries are used up.
+    """
+
+    retries = current_app.config["BOOKING_LOCK_RETRIES"]
+
+    for attempt in range(retries + 1):
+        try:
+            lock_properties(property_ids)
+            return write()
+        except OperationalError as e:
+            db.session.rollback()
+
+            if not _is_retryable(e):
+                raise
+            if attempt == retries:
+                raise PropertyBusy() from e
+
+            time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt
+                       * random.uniform(0.5, 1.5))
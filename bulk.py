@@ -0,0 +1,300 @@
+"""Bulk import/export of users, properties and bookings.
+
+    flask bulk import users users.csv
+    flask bulk import bookings bookings.jsonl --chunk-size 20000
+    flask bulk export properties properties.csv
+
+Rows are streamed from CSV or JSON Lines (picked by file extension or
+--format) and loaded in chunks, one transaction per chunk. On Postgres a
+chunk is loaded with COPY; other databases get one executemany INSERT.
+Plain-text user passwords are bcrypt-hashed in parallel on a pool of
+--hash-workers processes (one per CPU by default); values that already
+look like bcrypt hashes (e.g. from an export) are loaded as-is. Files
+missing a required column are rejected before anything is loaded.
+
+Exports stream rows with yield_per (or COPY TO on Postgres for CSV).
+"""
+
+import csv
+import io
+import json
+import sys
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from itertools import islice
+from multiprocessing import get_context
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+import passwords
+from models import db, User, Property, Booking
+
+TABLES = {
+    "users": User.__table__,
+    "properties": Property.__table__,
+    "bookings": Booking.__table__,
+}
+
+CHUNK_SIZE = 5000
+COPY_NULL = "\\N"
+
+bulk_cli = AppGroup("bulk", help="Bulk import/export of table data.")
+
+
+def read_rows(stream, fmt):
+    """Yield one dict per CSV row or JSON line from `stream`."""
+
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+        return
+
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def coerce(column, value):
+    """Convert a raw CSV/JSON value to the column's Python type."""
+
+    if value is None:
+        return None
+
+    if value == "" and not isinstance(column.type, db.String):
+        return None
+
+    if isinstance(column.type, db.JSON):
+        return json.loads(value) if isinstance(value, str) else value
+    if isinstance(column.type, db.DateTime):
+        return (value if isinstance(value, datetime)
+                else datetime.fromisoformat(value))
+    if isinstance(column.type, db.Integer):
+        return int(value)
+
+    return value
+
+
+def column_default(column):
+    """Return the Python-side default for a column, or None."""
+
+    default = column.default
+
+    if default is None:
+        return None
+    if default.is_callable:
+        return default.arg(None)
+
+    return default.arg
+
+
+def missing_columns(table, present):
+    """Return the names of `table`'s required columns not in `present`."""
+
+    return [column.name for column in table.columns
+            if column.name not in present
+            and not column.nullable
+            and column is not table.autoincrement_column
+            and column_default(column) is None]
+
+
+def hash_pool(table, workers):
+    """Return the process pool that hashes `table`'s passwords, as a
+    context manager yielding None when there is nothing to hash.
+    """
+
+    if table is not User.__table__ or workers < 2:
+        return nullcontext()
+
+    # spawn, not fork: the parent may hold open database connections.
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=get_context("spawn"))
+
+
+def prepare(table, columns, rows, executor=None):
+    """Coerce a chunk of raw rows into {column: value} dicts.
+
+    Plain-text user passwords are hashed on `executor` when given.
+    """
+
+    prepared = [
+        {name: (coerce(table.c[name], row[name]) if name in row
+                else column_default(table.c[name]))
+         for name in columns}
+        for row in rows
+    ]
+
+    if table is User.__table__:
+        plain = [row for row in prepared
+                 if not row["password"].startswith("$2")]
+        hashed = passwords.hash_many([row["password"] for row in plain],
+                                     executor=executor)
+        for row, pw_hash in zip(plain, hashed):
+            row["password"] = pw_hash
+
+    return prepared
+
+
+def copy_value(value):
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    return value
+
+
+def load_chunk(table, columns, rows):
+    """Insert one chunk of prepared rows in its own transaction."""
+
+    if db.engine.dialect.name != "postgresql":
+        db.session.execute(table.insert(), rows)
+        db.session.commit()
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([copy_value(row[name]) for name in columns])
+    buffer.seek(0)
+
+    quoted = ", ".join(f'"{name}"' for name in columns)
+    conn = db.engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {table.name} ({quoted}) FROM STDIN "
+                f"WITH (FORMAT csv, NULL '{COPY_NULL}')",
+                buffer)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def reset_id_sequence(table):
+    """Move a serial id sequence past explicitly imported ids."""
+
+    if db.engine.dialect.name == "postgresql" and "id" in table.c:
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"(SELECT COALESCE(MAX(id), 1) FROM {table.name}))"))
+        db.session.commit()
+
+
+def guess_format(path, fmt):
+    if fmt:
+        return fmt
+
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def report(verb, count, started):
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    click.echo(f"{verb} {count} rows in {elapsed:.1f}s "
+               f"({count / elapsed:,.0f} rows/sec)", err=True)
+
+
+@bulk_cli.command("import")
+@click.argument("table_name", type=click.Choice(list(TABLES)))
+@click.argument("path")
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]))
+@click.option("--chunk-size", default=CHUNK_SIZE, show_default=True)
+@click.option("--hash-workers", default=os.cpu_count() or 1,
+              show_default=True,
+              help="Processes hashing plain-text user passwords.")
+def import_rows(table_name, path, fmt, chunk_size, hash_workers):
+    """Load TABLE_NAME rows from PATH ("-" for stdin)."""
+
+    table = TABLES[table_name]
+    fmt = guess_format(path, fmt)
+    stream = sys.stdin if path == "-" else open(path, newline="")
+
+    rows = read_rows(stream, fmt)
+    count = 0
+    started = time.perf_counter()
+
+    with stream, hash_pool(table, hash_workers) as executor:
+        first = next(rows, None)
+        if first is None:
+            click.echo("No rows to import", err=True)
+            return
+
+        missing = missing_columns(table, first)
+        if missing:
+            raise click.ClickException(
+                f"{table_name} rows need column(s): {', '.join(missing)}")
+
+        columns = [column.name for column in table.columns
+                   if column.name in first
+                   or column_default(column) is not None]
+        pending = [first]
+
+        while True:
+            pending.extend(islice(rows, chunk_size - len(pending)))
+            if not pending:
+                break
+
+            load_chunk(table, columns,
+                       prepare(table, columns, pending, executor))
+            count += len(pending)
+            pending = []
+            report("Imported", count, started)
+
+    if "id" in columns:
+        reset_id_sequence(table)
+
+
+@bulk_cli.command("export")
+@click.argument("table_name", type=click.Choice(list(TABLES)))
+@click.argument("path", default="-")
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]))
+@click.option("--chunk-size", default=CHUNK_SIZE, show_default=True)
+def export_rows(table_name, path, fmt, chunk_size):
+    """Write every TABLE_NAME row to PATH (stdout by default)."""
+
+    table = TABLES[table_name]
+    fmt = guess_format(path, fmt)
+    columns = [column.name for column in table.columns]
+    stream = sys.stdout if path == "-" else open(path, "w", newline="")
+    started = time.perf_counter()
+    count = 0
+
+    with stream:
+        if fmt == "csv" and db.engine.dialect.name == "postgresql":
+            conn = db.engine.raw_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.copy_expert(
+                        f"COPY {table.name} TO STDOUT WITH (FORMAT csv, HEADER)",
+                        stream)
+                    count = cursor.rowcount
+            finally:
+                conn.close()
+
+            report("Exported", count, started)
+            return
+
+        result = db.session.execute(
+            table.select().order_by(*table.primary_key.columns),
+            execution_options={"yield_per": chunk_size})
+
+        if fmt == "csv":
+            writer = csv.writer(stream)
+            writer.writerow(columns)
+            for row in result:
+                writer.writerow([json.dumps(value)
+                                 if isinstance(value, (dict, list)) else value
+                                 for value in row])
+                count += 1
+        else:
+            for row in result:
+                stream.write(json.dumps(dict(row._mapping), default=str))
+                stream.write("\n")
+                count += 1
+
+    report("Exported", count, started)
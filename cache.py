@@ -0,0 +1,339 @@
+"""Response cache for public property reads.
+
+GET /property and GET /property/<id> return the same JSON to every
+caller, so their encoded bodies are cached in two layers:
+
+    local   an in-process LRU with a short TTL (CACHE_LOCAL_TTL), checked
+            first and free of any network hop
+    shared  a backend every worker sees (CACHE_BACKEND): "redis" at
+            CACHE_REDIS_URL, "memory" as a stand-in for a single-process
+            development server, or "none" (the default) to turn caching
+            off
+
+"memory" keeps the version counters and invalidations in one process,
+so it is refused when WEB_CONCURRENCY asks for more than one worker;
+caching across workers needs "redis".
+
+Every body is keyed by the version it is sent under: a property's
+updated_at, or a listing page's (count, last id, newest updated_at) from
+Property.version_query. A worker whose local layer still holds the old
+body looks up a different key once the row changes, so a body can never
+be paired with a newer ETag. Writes also bump a listings generation
+counter, which retires every cached listing page at once.
+
+Payloads embed presigned image URLs, so CACHE_TTL is capped below the
+signer's expiry margin and a cached body never outlives its URLs.
+"""
+
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from urllib.parse import urlencode
+
+from flask import current_app, jsonify
+
+import db_routing
+from aws_s3 import FILE_URL_EXPIRY_MARGIN
+
+GENERATION_KEY = "properties:generation"
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+class LocalCache():
+    """Thread-safe LRU of key -> value with a per-entry TTL."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MemoryBackend(LocalCache):
+    """Shared-backend stand-in that lives in this process only.
+
+    Counters are kept apart from the LRU so they are never evicted.
+    """
+
+    def __init__(self, max_entries, ttl):
+        super().__init__(max_entries, ttl)
+        self._counters = {}
+
+    def get(self, key):
+        if key in self._counters:
+            return self._counters[key]
+
+        return super().get(key)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend():
+    """Shared backend on Redis; values are stored as bytes."""
+
+    def __init__(self, url):
+        # Imported here so redis is only needed when it is configured.
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=max(1, int(ttl)))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*keys)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+
+class NullBackend():
+    """Backend that never stores anything."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def incr(self, key):
+        return 0
+
+
+def init_app(app):
+    """Build the cache layers for `app` from its config."""
+
+    app.config.setdefault("CACHE_BACKEND", "none")
+    app.config.setdefault("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    app.config.setdefault("CACHE_TTL", 60)
+    app.config.setdefault("CACHE_LOCAL_TTL", 5)
+    app.config.setdefault("CACHE_LOCAL_MAX_ENTRIES", 10000)
+
+    name = app.config["CACHE_BACKEND"]
+
+    if name == "redis":
+        shared = RedisBackend(app.config["CACHE_REDIS_URL"])
+    elif name == "memory":
+        if int(os.environ.get("WEB_CONCURRENCY", 1)) > 1:
+            raise ValueError("CACHE_BACKEND=memory is not shared between "
+                             "workers; use redis or none")
+        shared = MemoryBackend(app.config["CACHE_LOCAL_MAX_ENTRIES"],
+                               app.config["CACHE_TTL"])
+    elif name == "none":
+        shared = NullBackend()
+    else:
+        raise ValueError(f"Unknown CACHE_BACKEND: {name}")
+
+    ttl = min(app.config["CACHE_TTL"], FILE_URL_EXPIRY_MARGIN)
+    local_ttl = min(app.config["CACHE_LOCAL_TTL"], ttl)
+
+    app.extensions["response_cache"] = {
+        "enabled": name != "none",
+        "ttl": ttl,
+        "local": LocalCache(app.config["CACHE_LOCAL_MAX_ENTRIES"], local_ttl),
+        "shared": shared,
+    }
+    app.add_url_rule("/cache/stats", "cache_stats", get_stats)
+
+
+def _layers():
+    return current_app.extensions["response_cache"]
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def version_tag(*version):
+    return ":".join(
+        value.isoformat() if hasattr(value, "isoformat") else str(value)
+        for value in version)
+
+
+def property_key(property_id, updated_at):
+    """Return the cache key for property `property_id` at version
+    `updated_at`.
+    """
+
+    return f"property:{property_id}:{version_tag(updated_at)}"
+
+
+def get_version(key, layers=None):
+    """Return the shared counter `key`, or None when there is no shared
+    backend to keep one in.
+    """
+
+    layers = layers or _layers()
+
+    if not layers["enabled"]:
+        return None
+
+    return int(layers["shared"].get(key) or 0)
+
+
+def bump_version(key):
+    """Increment the shared counter `key`."""
+
+    _layers()["shared"].incr(key)
+
+
+def listing_key(items, version, layers=None):
+    """Return the cache key for a GET /property page with the query
+    params `items`, as (name, value) pairs, at `version` (the row of
+    Property.version_query the page's ETag was made from).
+    """
+
+    generation = get_version(GENERATION_KEY, layers)
+    query = urlencode(sorted(items))
+    return f"properties:{generation}:{version_tag(*version)}:{query}"
+
+
+def get_body(key, layers=None):
+    """Return the cached body for `key` from the local or shared layer,
+    or None on a miss.
+
+    `layers` defaults to the current app's; the ASGI views pass the
+    wrapped Flask app's explicitly.
+    """
+
+    layers = layers or _layers()
+    body = layers["local"].get(key)
+
+    if body is not None:
+        _count("local_hits")
+        return body
+
+    body = layers["shared"].get(key)
+
+    if body is not None:
+        _count("shared_hits")
+        layers["local"].set(key, body)
+        return body
+
+    _count("misses")
+    return None
+
+
+def set_body(key, body, layers=None):
+    """Cache an encoded body under `key` in both layers."""
+
+    layers = layers or _layers()
+    layers["shared"].set(key, body, layers["ttl"])
+    layers["local"].set(key, body)
+
+
+def cached_json(key, build):
+    """Return a JSON response for `key`, calling build() on a miss.
+
+    build() returns the dict to send; it is encoded once and the bytes
+    are cached. Responses carry X-Cache: HIT (local or shared) or MISS.
+    """
+
+    layers = _layers()
+
+    if not layers["enabled"]:
+        return jsonify(build())
+
+    body = get_body(key, layers)
+    status = "HIT"
+
+    if body is None:
+        status = "MISS"
+        # Read from the primary, or replica lag would be cached for
+        # every worker until CACHE_TTL.
+        with db_routing.primary():
+            body = current_app.json.dumps(build()).encode()
+        set_body(key, body, layers)
+
+    response = current_app.response_class(
+        body, mimetype=current_app.json.mimetype)
+    response.headers["X-Cache"] = status
+    return response
+
+
+def invalidate_properties(property_ids):
+    """Retire every cached listing page after a write to these properties.
+
+    Their own bodies need no deleting: they are keyed by updated_at, so
+    the changed row is looked up under a new key. Call after the change
+    is committed so a concurrent miss cannot re-cache the old page.
+    """
+
+    _layers()["shared"].incr(GENERATION_KEY)
+    _count("invalidations")
+
+
+def invalidate_property(property_id):
+    """Retire every cached listing page after a write to one property."""
+
+    invalidate_properties([property_id])
+
+
+def stats():
+    """Return this process's cache counters."""
+
+    with _stats_lock:
+        counts = dict(_stats)
+
+    hits = counts.get("local_hits", 0) + counts.get("shared_hits", 0)
+    lookups = hits + counts.get("misses", 0)
+
+    return {
+        "local_hits": counts.get("local_hits", 0),
+        "shared_hits": counts.get("shared_hits", 0),
+        "misses": counts.get("misses", 0),
+        "invalidations": counts.get("invalidations", 0),
+        "hit_rate": round(hits / lookups, 4) if lookups else None,
+        "local_entries": len(_layers()["local"]),
+    }
+
+
+def get_stats():
+    """handles GET request for this worker's response cache counters"""
+
+    return jsonify(cache=stats())
@@ -0,0 +1,102 @@
+"""Conditional GET support (ETag / Last-Modified).
+
+Validators are built from row versions (updated_at) and, for
+collections, from a count + max(updated_at) aggregate, so a request whose
+copy is current gets a 304 without anything being loaded or serialized.
+
+Bodies embed presigned image URLs that expire, so unless images are
+served from AWS_CDN_DOMAIN both validators also move forward every
+URL_EPOCH_SECONDS. A client revalidating an old copy is then sent fresh
+URLs instead of being told to keep expired ones.
+"""
+
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, request
+from werkzeug.http import parse_date, parse_etags
+
+from aws_s3 import AWS_CDN_DOMAIN, FILE_URL_EXPIRY_MARGIN
+
+URL_EPOCH_SECONDS = FILE_URL_EXPIRY_MARGIN // 2
+
+
+def url_epoch():
+    """Return the current image URL epoch (always 0 behind a CDN)."""
+
+    if AWS_CDN_DOMAIN:
+        return 0
+
+    return int(time.time() // URL_EPOCH_SECONDS)
+
+
+def make_etag(*parts):
+    """Return an opaque ETag value for a resource version.
+
+    `parts` should identify both the resource (kind, id, query string)
+    and its version (updated_at, row count).
+    """
+
+    raw = "|".join(str(part) for part in (*parts, url_epoch()))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _last_modified(updated_at):
+    """Return the Last-Modified value for a version timestamp."""
+
+    # Columns hold naive UTC; HTTP dates have one-second resolution.
+    if updated_at is not None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc, microsecond=0)
+
+    if AWS_CDN_DOMAIN:
+        return updated_at
+
+    epoch_start = datetime.fromtimestamp(url_epoch() * URL_EPOCH_SECONDS,
+                                         timezone.utc)
+    return max(updated_at, epoch_start) if updated_at else epoch_start
+
+
+def check(etag, updated_at, if_none_match=None, if_modified_since=None):
+    """Compare validators with raw request header values.
+
+    Returns (fresh, last_modified): whether the client's cached copy is
+    still current, and the Last-Modified value to send. If-None-Match
+    wins over If-Modified-Since, as RFC 9110 requires.
+    """
+
+    last_modified = _last_modified(updated_at)
+
+    if if_none_match:
+        return parse_etags(if_none_match).contains(etag), last_modified
+
+    since = parse_date(if_modified_since)
+
+    if since and last_modified:
+        return last_modified <= since, last_modified
+
+    return False, last_modified
+
+
+def respond(etag, updated_at, build):
+    """Return a 304 if the client's copy is current, else build().
+
+    `updated_at` is the newest version timestamp behind the response
+    (None for an empty collection). Either way the response carries the
+    ETag and Last-Modified headers.
+    """
+
+    fresh, last_modified = check(etag, updated_at,
+                                 request.headers.get("If-None-Match"),
+                                 request.headers.get("If-Modified-Since"))
+
+    if fresh:
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.make_response(build())
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+
+    return response
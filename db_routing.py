@@ -0,0 +1,124 @@
+"""Read-replica routing for the SQLAlchemy session.
+
+Replicas are configured as Flask-SQLAlchemy binds named replica_<n>.
+Plain SELECTs made while handling GET/HEAD requests go to one replica
+(picked per request); everything else goes to the primary.
+
+Reads stay on the primary for the rest of a request once it has written,
+and the response sets a short-lived cookie so that the same client's
+next reads also hit the primary until the replicas have caught up.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+REPLICA_PREFIX = "replica_"
+STICKY_COOKIE = "db_primary_until"
+READ_METHODS = ("GET", "HEAD")
+
+
+class RoutingSession(Session):
+    """Session that sends read-only request queries to a replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _can_use_replica(clause):
+            engine = _replica_engine(self._db.engines)
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+def replica_binds(urls):
+    """Return SQLALCHEMY_BINDS entries for a list of replica URLs."""
+
+    return {f"{REPLICA_PREFIX}{i}": url for i, url in enumerate(urls)}
+
+
+def init_app(app):
+    """Set the read-your-writes cookie after requests that wrote."""
+
+    app.config.setdefault("DB_STICKY_SECONDS", 5)
+    app.after_request(_set_sticky_cookie)
+
+
+@contextmanager
+def primary():
+    """Send this request's reads to the primary inside the block.
+
+    For reads whose result outlives the request, such as cache fills, so
+    replica lag isn't stored along with them.
+    """
+
+    if not has_request_context():
+        yield
+        return
+
+    previous = g.get("db_primary", False)
+    g.db_primary = True
+
+    try:
+        yield
+    finally:
+        g.db_primary = previous
+
+
+def _can_use_replica(clause):
+    if not has_request_context() or request.method not in READ_METHODS:
+        return False
+
+    if g.get("db_wrote") or g.get("db_primary") or _is_sticky():
+        return False
+
+    if clause is not None:
+        if not isinstance(clause, Select):
+            return False
+        if clause._for_update_arg is not None:
+            return False
+
+    return True
+
+
+def _is_sticky():
+    try:
+        until = float(request.cookies.get(STICKY_COOKIE, 0))
+    except ValueError:
+        return False
+
+    return until > time.time()
+
+
+def _replica_engine(engines):
+    """Return this request's replica engine, or None without replicas."""
+
+    if "db_replica" not in g:
+        names = [key for key in engines
+                 if key and key.startswith(REPLICA_PREFIX)]
+        g.db_replica = random.choice(names) if names else None
+
+    return engines[g.db_replica] if g.db_replica else None
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_write(session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def _set_sticky_cookie(response):
+    if g.get("db_wrote"):
+        seconds = current_app.config["DB_STICKY_SECONDS"]
+        response.set_cookie(STICKY_COOKIE,
+                            str(time.time() + seconds),
+                            max_age=seconds,
+                            httponly=True,
+                            samesite="Lax")
+
+    return response
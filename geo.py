@@ -0,0 +1,136 @@
+"""Geohash indexing and distance helpers for property search.
+
+Each located property stores a geohash of its coordinates. Nearby points
+share a geohash prefix, so a bounding box becomes a handful of prefix
+ranges on an ordinary btree index (see cover()), and only rows in those
+cells are checked against the exact bounds. Radius searches use the
+box around the circle, then filter and order by great-circle distance.
+"""
+
+from math import asin, cos, degrees, floor, radians, sin, sqrt
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 9  # ~5m cells
+MAX_COVER_CELLS = 32
+EARTH_RADIUS_KM = 6371.0088
+
+# Sorts after every geohash character, so [cell, cell + PREFIX_END)
+# is the range of hashes starting with `cell`.
+PREFIX_END = "{"
+
+
+def is_valid(lat, lng):
+    return -90 <= lat <= 90 and -180 <= lng <= 180
+
+
+def encode(lat, lng, precision=GEOHASH_PRECISION):
+    """Return the geohash of a point."""
+
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(chars) < precision:
+        value, bounds = (lng, lng_range) if even else (lat, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+
+        if value >= mid:
+            bits = bits * 2 + 1
+            bounds[0] = mid
+        else:
+            bits = bits * 2
+            bounds[1] = mid
+
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """Return (height, width) in degrees of a geohash cell."""
+
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def _grid_span(low, high, origin, size, cells):
+    first = floor((low - origin) / size)
+    last = min(floor((high - origin) / size), cells - 1)
+    return range(first, last + 1)
+
+
+def cover(min_lat, min_lng, max_lat, max_lng, max_cells=MAX_COVER_CELLS):
+    """Return geohash prefixes whose cells together cover the box.
+
+    Picks the finest precision that needs at most `max_cells` cells, so a
+    city-sized box becomes a few dozen index ranges. A box with
+    min_lng > max_lng crosses the antimeridian.
+    """
+
+    if min_lng > max_lng:
+        return (cover(min_lat, min_lng, max_lat, 180.0, max_cells)
+                + cover(min_lat, -180.0, max_lat, max_lng, max_cells))
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = _grid_span(min_lat, max_lat, -90.0, height, round(180 / height))
+        cols = _grid_span(min_lng, max_lng, -180.0, width, round(360 / width))
+
+        if len(rows) * len(cols) <= max_cells:
+            break
+
+    return sorted({
+        encode(-90.0 + (row + 0.5) * height,
+               -180.0 + (col + 0.5) * width,
+               precision)
+        for row in rows
+        for col in cols
+    })
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Return the great-circle (haversine) distance between two points."""
+
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+    a = (sin((lat2 - lat1) / 2) ** 2
+         + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+
+def bounding_box(lat, lng, radius_km):
+    """Return (min_lat, min_lng, max_lat, max_lng) around a circle.
+
+    min_lng > max_lng when the box crosses the antimeridian.
+    """
+
+    angle = radius_km / EARTH_RADIUS_KM
+    min_lat = lat - degrees(angle)
+    max_lat = lat + degrees(angle)
+
+    # Near a pole the circle spans every longitude.
+    if min_lat <= -90 or max_lat >= 90 or angle >= 1:
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+
+    spread = degrees(asin(min(1.0, sin(angle) / cos(radians(lat)))))
+
+    if spread >= 180:
+        return min_lat, -180.0, max_lat, 180.0
+
+    min_lng = lng - spread
+    max_lng = lng + spread
+
+    if min_lng < -180:
+        min_lng += 360
+    if max_lng > 180:
+        max_lng -= 360
+
+    return min_lat, min_lng, max_lat, max_lng
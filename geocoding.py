@@ -0,0 +1,101 @@
+"""Address geocoding for property listings.
+
+GEOCODER picks the implementation:
+
+    stub         deterministic made-up coordinates near
+                 GEOCODER_STUB_CENTER, for local development only
+    nominatim    OpenStreetMap's Nominatim search API at GEOCODER_URL
+    none         never geocode (the default)
+    module:attr  any callable taking an address and returning
+                 (lat, lng) or None
+
+Geocoding never fails a request: errors are logged and the property is
+saved without coordinates.
+"""
+
+import hashlib
+import importlib
+import json
+import logging
+import os
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+GEOCODER = os.environ.get('GEOCODER', 'none')
+GEOCODER_URL = os.environ.get(
+    'GEOCODER_URL', 'https://nominatim.openstreetmap.org/search')
+GEOCODER_TIMEOUT = float(os.environ.get('GEOCODER_TIMEOUT', 3))
+GEOCODER_STUB_CENTER = os.environ.get('GEOCODER_STUB_CENTER', '37.77,-122.42')
+GEOCODER_STUB_SPREAD = 0.25  # degrees either side of the centre
+
+USER_AGENT = 'sharenbn-backend'
+
+logger = logging.getLogger(__name__)
+
+_geocoder = {}
+
+
+def stub_geocode(address):
+    """Return stable fake coordinates for `address`."""
+
+    digest = hashlib.sha256(address.strip().lower().encode()).digest()
+    center_lat, center_lng = map(float, GEOCODER_STUB_CENTER.split(','))
+
+    def offset(chunk):
+        fraction = int.from_bytes(chunk, 'big') / 0xFFFFFFFF
+        return (fraction * 2 - 1) * GEOCODER_STUB_SPREAD
+
+    return center_lat + offset(digest[:4]), center_lng + offset(digest[4:8])
+
+
+def nominatim_geocode(address):
+    """Look `address` up with the Nominatim search API."""
+
+    query = urlencode({'q': address, 'format': 'json', 'limit': 1})
+    request = Request(f'{GEOCODER_URL}?{query}',
+                      headers={'User-Agent': USER_AGENT})
+
+    with urlopen(request, timeout=GEOCODER_TIMEOUT) as response:
+        results = json.load(response)
+
+    if not results:
+        return None
+
+    return float(results[0]['lat']), float(results[0]['lon'])
+
+
+BUILTIN = {
+    'stub': stub_geocode,
+    'nominatim': nominatim_geocode,
+    'none': lambda address: None,
+}
+
+
+def get_geocoder():
+    """Return the configured geocoder callable."""
+
+    if 'fn' not in _geocoder:
+        if GEOCODER in BUILTIN:
+            fn = BUILTIN[GEOCODER]
+        elif ':' in GEOCODER:
+            module, attr = GEOCODER.split(':', 1)
+            fn = getattr(importlib.import_module(module), attr)
+        else:
+            raise ValueError(f'Unknown GEOCODER: {GEOCODER}')
+
+        _geocoder['fn'] = fn
+
+    return _geocoder['fn']
+
+
+def geocode(address):
+    """Return (lat, lng) for `address`, or None if it can't be located."""
+
+    if not address:
+        return None
+
+    try:
+        return get_geocoder()(address)
+    except Exception:
+        logger.exception('Geocoding failed for %r', address)
+        return None
@@ -0,0 +1,38 @@
+"""Gunicorn settings for SharenBn.
+
+    gunicorn -c gunicorn.conf.py
+
+The app is built once in the master (preload_app) and forked into
+workers. Workers drop any database connections inherited from the master
+and build their own S3 client on first use.
+"""
+
+import os
+
+wsgi_app = "app:create_app()"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5001")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = True
+
+
+def on_starting(server):
+    """Refuse a response cache that each worker would keep to itself."""
+
+    config = server.app.wsgi().config
+
+    if config["CACHE_BACKEND"] == "memory" and server.cfg.workers > 1:
+        raise RuntimeError("CACHE_BACKEND=memory is not shared between "
+                           "workers; use redis or none")
+
+
+def post_fork(server, worker):
+    """Give each worker a fresh connection pool."""
+
+    from models import db
+
+    app = server.app.wsgi()
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
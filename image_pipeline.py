@@ -0,0 +1,157 @@
+"""Background processing for property images.
+
+Uploaded images are re-stored under content-addressed keys
+(images/<sha256>/...) so identical files share one object and two hosts'
+`house.jpg` never collide. Each image also gets resized WebP variants for
+listing pages. Decoding and resizing run in a process pool; S3 transfers
+and the final database update run on a small thread pool so request
+handlers only pay for queueing the job.
+"""
+
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from flask import current_app
+from PIL import Image
+
+IMAGE_PREFIX = 'images'
+IMAGE_PROCESSES = int(os.environ.get('IMAGE_PROCESSES', 2))
+IMAGE_IO_THREADS = int(os.environ.get('IMAGE_IO_THREADS', 4))
+WEBP_QUALITY = 80
+
+# name -> bounding box; None keeps the original size
+VARIANTS = {
+    'thumb': (320, 240),
+    'medium': (1024, 768),
+    'full': None,
+}
+
+EXTENSIONS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+}
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def process_image(data):
+    """Hash, sniff and resize an image.
+
+    Runs in a worker process, so it takes and returns plain bytes.
+
+    Returns (original_key, variants, outputs) where variants maps variant
+    name -> key and outputs maps key -> (bytes, content_type). Raises
+    ValueError if `data` is not a supported image.
+    """
+
+    digest = hashlib.sha256(data).hexdigest()
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f'Unreadable image: {e}')
+
+    if image.format not in EXTENSIONS:
+        raise ValueError(f'Unsupported image format: {image.format}')
+
+    original_key = (f'{IMAGE_PREFIX}/{digest}/'
+                    f'original.{EXTENSIONS[image.format]}')
+    outputs = {original_key: (data, Image.MIME[image.format])}
+    variants = {}
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    for name, size in VARIANTS.items():
+        variant = image.copy()
+        if size:
+            variant.thumbnail(size)
+
+        buffer = io.BytesIO()
+        variant.save(buffer, 'WEBP', quality=WEBP_QUALITY)
+
+        key = f'{IMAGE_PREFIX}/{digest}/{name}.webp'
+        variants[name] = key
+        outputs[key] = (buffer.getvalue(), 'image/webp')
+
+    return original_key, variants, outputs
+
+
+def _get_pools():
+    """Return this process's (process pool, thread pool), creating them
+    on first use so forked servers never inherit them.
+    """
+
+    pid = os.getpid()
+
+    with _pools_lock:
+        if _pools.get('pid') != pid:
+            _pools.clear()
+            _pools['pid'] = pid
+            _pools['processes'] = ProcessPoolExecutor(
+                max_workers=IMAGE_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            _pools['threads'] = ThreadPoolExecutor(
+                max_workers=IMAGE_IO_THREADS,
+                thread_name_prefix='image-io',
+            )
+
+        return _pools['processes'], _pools['threads']
+
+
+def submit(property_id, source_key):
+    """Queue processing of the image uploaded under `source_key`.
+
+    Must be called inside an app context. Returns a Future.
+    """
+
+    app = current_app._get_current_object()
+    _, threads = _get_pools()
+    return threads.submit(_run, app, property_id, source_key)
+
+
+def _run(app, property_id, source_key):
+    """Process one upload and point the property at the results."""
+
+    # Imported here so spawned image workers only need PIL.
+    import cache
+    from aws_s3 import Aws, MAX_UPLOAD_SIZE
+    from models import db, Property
+
+    try:
+        data = Aws.get_file(source_key, max_size=MAX_UPLOAD_SIZE)
+        processes, _ = _get_pools()
+        original_key, variants, outputs = (
+            processes.submit(process_image, data).result())
+
+        for key, (body, content_type) in outputs.items():
+            if not Aws.file_exists(key):
+                Aws.put_file(key, body, content_type)
+
+        with app.app_context():
+            property = db.session.get(Property, property_id)
+
+            # The image may have been replaced while this job ran.
+            if property is None or property.img_key != source_key:
+                return
+
+            property.img_key = original_key
+            property.img_variants = variants
+            db.session.commit()
+            cache.invalidate_property(property_id)
+
+    except Exception:
+        logger.exception('Image processing failed for %s', source_key)
+        raise
@@ -0,0 +1,30 @@
+-- Store S3 object keys instead of presigned URLs on properties.
+-- Image URLs are now minted at serialization time.
+--
+-- Run with: psql "$DATABASE_URL" -v bucket="$AWS_BUCKET_NAME" -f <this file>
+
+BEGIN;
+
+ALTER TABLE properties RENAME COLUMN img_url TO img_key;
+
+-- Undo the percent-escaping of a URL path: presigned URLs escape their
+-- key, so "my house (1).jpg" was stored as "my%20house%20%281%29.jpg".
+CREATE FUNCTION pg_temp.url_decode(path TEXT) RETURNS TEXT AS $$
+    SELECT coalesce(convert_from(string_agg(
+        CASE WHEN part[1] ~ '^%[0-9A-Fa-f]{2}$'
+             THEN decode(substr(part[1], 2), 'hex')
+             ELSE convert_to(part[1], 'UTF8')
+        END, ''::bytea ORDER BY n), 'UTF8'), '')
+    FROM regexp_matches(path, '%[0-9A-Fa-f]{2}|[^%]+|%', 'g')
+         WITH ORDINALITY AS parts(part, n)
+$$ LANGUAGE sql;
+
+-- Keep only the URL path, drop the bucket segment of path-style URLs,
+-- then decode what's left into the object key.
+UPDATE properties
+SET img_key = pg_temp.url_decode(regexp_replace(
+    regexp_replace(img_key, '^https?://[^/]+/([^?]*).*$', '\1'),
+    '^' || :'bucket' || '/', ''))
+WHERE img_key ~ '^https?://';
+
+COMMIT;
@@ -0,0 +1,8 @@
+-- Processed image variants (thumbnail/WebP keys) per property.
+
+BEGIN;
+
+ALTER TABLE properties
+    ADD COLUMN img_variants JSON NOT NULL DEFAULT '{}';
+
+COMMIT;
@@ -0,0 +1,29 @@
+-- Reference properties from bookings by integer id instead of address.
+
+BEGIN;
+
+ALTER TABLE bookings ADD COLUMN property_id INTEGER;
+
+UPDATE bookings
+SET property_id = properties.id
+FROM properties
+WHERE properties.address = bookings.address;
+
+-- Bookings whose address no longer matches a property are unreachable.
+DELETE FROM bookings WHERE property_id IS NULL;
+
+ALTER TABLE bookings
+    ALTER COLUMN property_id SET NOT NULL,
+    ADD CONSTRAINT bookings_property_id_fkey
+        FOREIGN KEY (property_id) REFERENCES properties (id)
+        ON DELETE CASCADE;
+
+DROP INDEX IF EXISTS ix_bookings_address_dates;
+ALTER TABLE bookings DROP COLUMN address;
+
+CREATE INDEX ix_bookings_property_id_start_date
+    ON bookings (property_id, start_date);
+CREATE INDEX ix_bookings_username_start_date
+    ON bookings (username, start_date);
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- Row versions for ETag / Last-Modified on properties and bookings.
+
+BEGIN;
+
+ALTER TABLE properties
+    ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc');
+ALTER TABLE bookings
+    ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc');
+
+COMMIT;
@@ -0,0 +1,15 @@
+-- Coordinates and geohash index for map / radius search.
+--
+-- Existing rows have no coordinates until their address or location
+-- is next edited.
+
+BEGIN;
+
+ALTER TABLE properties
+    ADD COLUMN latitude DOUBLE PRECISION,
+    ADD COLUMN longitude DOUBLE PRECISION,
+    ADD COLUMN geohash VARCHAR(9) COLLATE "C";
+
+CREATE INDEX ix_properties_geohash ON properties (geohash);
+
+COMMIT;
@@ -0,0 +1,16 @@
+-- Full-text search over property address and description.
+--
+-- Must match SEARCH_DOCUMENT in models.py.
+
+BEGIN;
+
+ALTER TABLE properties
+    ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(address, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX ix_properties_search_vector
+    ON properties USING GIN (search_vector);
+
+COMMIT;
@@ -0,0 +1,8 @@
+-- Per-property pricing rules (see pricing.parse_rules); empty means
+-- price_rate every night.
+
+BEGIN;
+
+ALTER TABLE properties ADD COLUMN pricing JSON NOT NULL DEFAULT '{}';
+
+COMMIT;
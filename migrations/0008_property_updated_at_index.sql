@@ -0,0 +1,8 @@
+-- Index for the newest-row lookup in listing ETags (see
+-- Property.version_query).
+
+BEGIN;
+
+CREATE INDEX ix_properties_updated_at ON properties (updated_at);
+
+COMMIT;
@@ -0,0 +1,18 @@
+-- Indexes behind GET /property's filters and keyset pages, which until
+-- now only db.create_all() created. IF NOT EXISTS because databases built
+-- that way already have them.
+--
+-- The bookings overlap index is covered already: 0003 drops the old
+-- (address, start_date, end_date) one and creates its property_id
+-- replacements.
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS ix_properties_price_rate
+    ON properties (price_rate);
+CREATE INDEX IF NOT EXISTS ix_properties_sqft
+    ON properties (sqft);
+CREATE INDEX IF NOT EXISTS ix_properties_user_id
+    ON properties ("user", id);
+
+COMMIT;
@@ -0,0 +1,12 @@
+-- Cap a booking at 365 days (models.MAX_STAY_DAYS). Overlap checks bound
+-- start_date from below by that much, so they would miss any longer
+-- booking; this fails, and leaves the table unchanged, if one exists.
+-- Shorten or split those bookings and run it again.
+
+BEGIN;
+
+ALTER TABLE bookings
+    ADD CONSTRAINT ck_bookings_stay_length
+    CHECK (end_date - start_date <= interval '365 days');
+
+COMMIT;
@@ -1,22 +1,66 @@
 """SQLAlchemy models for Warbler."""
 
-from datetime import datetime
+import heapq
+import sqlite3
+from datetime import datetime, timedelta
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, literal, union_all, values
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import joinedload, selectinload
+
+import availability
+import geo
+import passwords
+from aws_s3 import Aws
+from db_routing import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+TIME_FORMAT = "%Y-%m-%d"
+
+# Longest booking, in days from start_date to end_date. Capping it lets
+# every overlap check bound start_date from below as well as above, so
+# the (property_id, start_date) index scan stops MAX_STAY_DAYS before the
+# requested stay instead of running back to the property's first booking.
+MAX_STAY_DAYS = 365
+
+# Full-text search runs against properties.search_vector, a stored
+# generated tsvector with a GIN index that only exists on Postgres (see
+# the DDL after Property), so it is not a mapped column. Address matches
+# are weighted above description matches.
+SEARCH_CONFIG = "english"
+SEARCH_DOCUMENT = (
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(address, '')), 'A')"
+    f" || setweight(to_tsvector('{SEARCH_CONFIG}', "
+    f"coalesce(description, '')), 'B')"
+)
+search_vector = db.literal_column("properties.search_vector", TSVECTOR)
+
+
+@event.listens_for(Engine, "connect")
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """Turn on foreign keys for SQLite, which ignores them by default.
+
+    Users, properties and bookings are deleted through their ON DELETE
+    CASCADE foreign keys (passive_deletes), so without this a deleted
+    user's properties and bookings would stay behind.
+    """
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
 
 
 def connect_db(app):
     """Connect this database to provided Flask app.
 
-    You should call this in your Flask app.
+    You should call this in your Flask app. No connection is opened until
+    the first query, so this is safe to run before a server forks.
     """
 
-    app.app_context().push()
-    db.app = app
     db.init_app(app)
 
 
@@ -54,18 +98,23 @@ class User(db.Model):
     properties = db.relationship(
         'Property',
         backref='owner',
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
     bookings = db.relationship(
         'Booking',
         backref='customer',
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
     def serialize(self):
         """Serialize to dictionary."""
 
+        Property.sign_images(
+            [*self.properties, *(b.property for b in self.bookings)])
+
         return {
             "username": self.username,
             "first_name": self.first_name,
@@ -75,6 +124,20 @@ class User(db.Model):
             "bookings": [b.serialize() for b in self.bookings]
         }
 
+    @classmethod
+    def with_listings(cls):
+        """Query users with everything serialize() touches eager-loaded.
+
+        Properties and bookings are fetched with one SELECT ... IN each,
+        and each booking's property is joined in, so serializing a user
+        costs a constant number of queries.
+        """
+
+        return cls.query.options(
+            selectinload(cls.properties),
+            selectinload(cls.bookings).joinedload(Booking.property),
+        )
+
     @classmethod
     def signup(cls, username, email, password, first_name, last_name):
         """Sign up user.
@@ -82,7 +145,7 @@ class User(db.Model):
         Hashes password and adds user to session.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash_password(password)
 
         user = User(
             username=username,
@@ -106,13 +169,19 @@ class User(db.Model):
 
         If this can't find matching user (or if password is wrong), returns
         False.
+
+        Hashes made at an old BCRYPT_LOG_ROUNDS cost are upgraded on a
+        successful login.
         """
 
         user = cls.query.filter_by(username=username).one_or_none()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check_password(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash_password(password)
+                    db.session.commit()
                 return user
 
         return False
@@ -123,6 +192,9 @@ class Property(db.Model):
     """Property in the system."""
 
     __tablename__ = 'properties'
+    __table_args__ = (
+        db.Index('ix_properties_user_id', 'user', 'id'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -138,6 +210,7 @@ class Property(db.Model):
     price_rate = db.Column(
         db.Integer,
         nullable=False,
+        index=True
     )
 
     user = db.Column(
@@ -147,29 +220,72 @@ class Property(db.Model):
 
     sqft = db.Column(
         db.Integer,
-        nullable=False
+        nullable=False,
+        index=True
     )
 
-    img_url = db.Column(
+    img_key = db.Column(
         db.String,
         nullable=False
     )
 
+    img_variants = db.Column(
+        db.JSON,
+        nullable=False,
+        default=dict
+    )
+
     description =db.Column(
         db.String,
         default=""
     )
 
+    # Seasonal / weekday / length-of-stay rules, see pricing.parse_rules
+    pricing = db.Column(
+        db.JSON,
+        nullable=False,
+        default=dict
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        index=True
+    )
+
+    latitude = db.Column(
+        db.Float
+    )
+
+    longitude = db.Column(
+        db.Float
+    )
+
+    # "C" collation so prefix ranges compare bytewise (see geo.cover).
+    geohash = db.Column(
+        db.String(geo.GEOHASH_PRECISION).with_variant(
+            db.String(geo.GEOHASH_PRECISION, collation="C"), "postgresql"),
+        index=True
+    )
+
+    # Read-only: bookings are written through Booking, and deleting a
+    # property must not also delete its bookings row by row.
     customers = db.relationship(
         'User',
         secondary='bookings',
-        backref='booked_properties',
+        backref=db.backref('booked_properties', viewonly=True),
+        viewonly=True,
     )
 
+    # Child rows are removed by the ON DELETE CASCADE foreign keys rather
+    # than loaded and deleted one at a time.
     bookings = db.relationship(
         'Booking',
         backref='property',
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
 
@@ -182,36 +298,314 @@ class Property(db.Model):
             "price_rate": self.price_rate,
             "owner": self.user,
             "sqft": self.sqft,
-            "img_url": self.img_url,
-            "description":self.description
+            "img_url": Aws.get_file_url(self.img_key),
+            "img_variants": {name: Aws.get_file_url(key)
+                             for name, key in self.image_variants().items()},
+            "description":self.description,
+            "latitude": self.latitude,
+            "longitude": self.longitude
         }
 
+    def image_variants(self):
+        """Return {variant name: object key} for the processed image."""
+
+        return self.img_variants or {}
+
+    def set_image(self, img_key):
+        """Point the property at a new image.
+
+        Variants belong to the previous image and are dropped until the
+        image pipeline has processed the new one.
+        """
+
+        self.img_key = img_key
+        self.img_variants = {}
+
+    def set_location(self, latitude, longitude):
+        """Set the coordinates (None for unknown) and their geohash."""
+
+        self.latitude = latitude
+        self.longitude = longitude
+        self.geohash = (geo.encode(latitude, longitude)
+                        if latitude is not None and longitude is not None
+                        else None)
+
+    @classmethod
+    def sign_images(cls, properties):
+        """Mint image URLs for many properties in one batch.
+
+        Call before serializing a list so serialize() reads the URLs from
+        the signer's cache instead of signing row by row.
+        """
+
+        keys = set()
+        for p in properties:
+            keys.add(p.img_key)
+            keys.update(p.image_variants().values())
+
+        Aws.get_file_urls(keys)
+
+    @classmethod
+    def serialize_many(cls, properties):
+        """Serialize a list of properties, signing their images in bulk."""
+
+        properties = list(properties)
+        cls.sign_images(properties)
+        return [p.serialize() for p in properties]
+
     @classmethod
-    def add_property(cls, address, price_rate, owner, sqft, img_url,description):
+    def filter_criteria(cls, min_price=None, max_price=None, min_sqft=None,
+                        max_sqft=None, owner=None):
+        """Return the WHERE clauses for the given filters.
+
+        Filters left as None are not applied.
+        """
+
+        criteria = []
+
+        if min_price is not None:
+            criteria.append(cls.price_rate >= min_price)
+        if max_price is not None:
+            criteria.append(cls.price_rate <= max_price)
+        if min_sqft is not None:
+            criteria.append(cls.sqft >= min_sqft)
+        if max_sqft is not None:
+            criteria.append(cls.sqft <= max_sqft)
+        if owner is not None:
+            criteria.append(cls.user == owner)
+
+        return criteria
+
+    @classmethod
+    def filtered(cls, min_price=None, max_price=None, min_sqft=None,
+                 max_sqft=None, owner=None):
+        """Return a query of properties matching the given filters.
+
+        Filters left as None are not applied.
+        """
+
+        return cls.query.filter(*cls.filter_criteria(
+            min_price, max_price, min_sqft, max_sqft, owner))
+
+    @classmethod
+    def unbooked_criterion(cls, start_date, end_date):
+        """Return the WHERE clause for properties with no booking
+        overlapping the dates (an anti-join against bookings).
+        """
+
+        overlapping = (
+            db.select(Booking.id)
+            .where(Booking.property_id == cls.id,
+                   *Booking.overlap_criteria(start_date, end_date))
+            .exists()
+        )
+
+        return ~overlapping
+
+    @classmethod
+    def available(cls, query, start_date, end_date):
+        """Narrow `query` to properties with no booking overlapping the
+        dates.
+        """
+
+        return query.filter(cls.unbooked_criterion(start_date, end_date))
+
+    @classmethod
+    def within(cls, query, min_lat, min_lng, max_lat, max_lng):
+        """Narrow `query` to properties inside a bounding box.
+
+        The geohash index finds the candidate cells; the coordinates are
+        then checked exactly. min_lng > max_lng crosses the antimeridian.
+        """
+
+        cells = db.or_(*[
+            db.and_(cls.geohash >= cell, cls.geohash < cell + geo.PREFIX_END)
+            for cell in geo.cover(min_lat, min_lng, max_lat, max_lng)
+        ])
+
+        if min_lng > max_lng:
+            lng_filter = db.or_(cls.longitude >= min_lng,
+                                cls.longitude <= max_lng)
+        else:
+            lng_filter = cls.longitude.between(min_lng, max_lng)
+
+        return query.filter(cells,
+                            cls.latitude.between(min_lat, max_lat),
+                            lng_filter)
+
+    @classmethod
+    def nearest(cls, query, lat, lng, radius_km, limit=20):
+        """Return [(property, distance_km)] within `radius_km` of a point,
+        nearest first.
+
+        Only ids and coordinates of the rows in the surrounding box are
+        fetched to rank them; full rows are loaded for the closest `limit`.
+        """
+
+        box = geo.bounding_box(lat, lng, radius_km)
+        candidates = (cls.within(query, *box)
+                      .order_by(None)
+                      .with_entities(cls.id, cls.latitude, cls.longitude))
+
+        in_radius = []
+        for id, p_lat, p_lng in candidates:
+            distance = geo.distance_km(lat, lng, p_lat, p_lng)
+            if distance <= radius_km:
+                in_radius.append((distance, id))
+
+        ranked = heapq.nsmallest(limit, in_radius)
+
+        ids = [id for _, id in ranked]
+        by_id = {p.id: p for p in cls.query.filter(cls.id.in_(ids))}
+
+        return [(by_id[id], distance) for distance, id in ranked]
+
+    @classmethod
+    def search_page(cls, query, terms, cursor=None, limit=20):
+        """Return (properties, next_cursor) for one page of a full-text
+        search over address and description (Postgres only).
+
+        `terms` uses web search syntax ("quoted phrase", or, -word).
+        Results are ordered by relevance, then id; `cursor` is the
+        "rank,id" string returned for the previous page.
+        """
+
+        tsquery = db.func.websearch_to_tsquery(SEARCH_CONFIG, terms)
+        rank = db.func.ts_rank(search_vector, tsquery)
+        query = query.filter(search_vector.op("@@")(tsquery))
+
+        if cursor is not None:
+            last_rank, last_id = cursor.split(",")
+            # ts_rank is a real; compare at that precision so the row the
+            # cursor came from matches itself exactly.
+            last_rank = db.cast(float(last_rank), db.REAL)
+            last_id = int(last_id)
+            query = query.filter(db.or_(
+                rank < last_rank,
+                db.and_(rank == last_rank, cls.id > last_id),
+            ))
+
+        rows = (query.add_columns(rank)
+                .order_by(rank.desc(), cls.id)
+                .limit(limit + 1)
+                .all())
+
+        next_cursor = None
+
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last_property, last_rank = rows[-1]
+            next_cursor = f"{last_rank!r},{last_property.id}"
+
+        return [property for property, _ in rows], next_cursor
+
+    @classmethod
+    def version(cls, property_id):
+        """Return a property's updated_at without loading the row, or
+        None if it does not exist.
+        """
+
+        return (db.session.query(cls.updated_at)
+                .filter(cls.id == property_id)
+                .scalar())
+
+    @classmethod
+    def version_query(cls, criteria, cursor=None, limit=None):
+        """Return a SELECT of (row count, last id, newest updated_at) for
+        the keyset page of properties matching `criteria` that page_after
+        returns, or for every match when `limit` is None.
+
+        The page is read through the primary key index, so a version
+        costs no more than the page itself. The extra row page_after
+        fetches is included, so the version also covers `next_cursor`.
+        """
+
+        page = db.select(cls.id, cls.updated_at).where(*criteria)
+
+        if cursor is not None:
+            page = page.where(cls.id > cursor)
+        if limit is not None:
+            page = page.order_by(cls.id).limit(limit + 1)
+
+        page = page.subquery()
+
+        return db.select(db.func.count(page.c.id),
+                         db.func.max(page.c.id),
+                         db.func.max(page.c.updated_at))
+
+    @classmethod
+    def collection_version(cls, criteria, cursor=None, limit=None):
+        """Run version_query()."""
+
+        return db.session.execute(
+            cls.version_query(criteria, cursor, limit)).one()
+
+    @classmethod
+    def page_after(cls, query, cursor=None, limit=20):
+        """Return (properties, next_cursor) for one keyset page of `query`.
+
+        Pages are ordered by id; `cursor` is the last id of the previous
+        page. `next_cursor` is None once there are no more rows.
+        """
+
+        if cursor is not None:
+            query = query.filter(cls.id > cursor)
+
+        properties = query.order_by(cls.id).limit(limit + 1).all()
+
+        if len(properties) > limit:
+            properties = properties[:limit]
+            return properties, properties[-1].id
+
+        return properties, None
+
+    @classmethod
+    def add_property(cls, address, price_rate, owner, sqft, img_key,description,
+                     location=None):
         """Creates property listing.
 
-        Adds property to database
+        Adds property to database; `location` is an optional (lat, lng)
         """
 
-        location = Property(
+        property = Property(
             address=address,
             price_rate=price_rate,
             owner=owner,
             sqft=sqft,
-            img_url=img_url,
+            img_key=img_key,
+            img_variants={},
             description=description
         )
 
-        db.session.add(location)
+        if location:
+            property.set_location(*location)
+
+        db.session.add(property)
         db.session.commit()
-        return location
+        return property
 
 
+event.listen(Property.__table__, "after_create", DDL(
+    "ALTER TABLE properties ADD COLUMN search_vector tsvector "
+    f"GENERATED ALWAYS AS ({SEARCH_DOCUMENT}) STORED"
+).execute_if(dialect="postgresql"))
+
+event.listen(Property.__table__, "after_create", DDL(
+    "CREATE INDEX ix_properties_search_vector "
+    "ON properties USING GIN (search_vector)"
+).execute_if(dialect="postgresql"))
+
 
 class Booking(db.Model):
     """An individual booking."""
 
     __tablename__ = 'bookings'
+    __table_args__ = (
+        db.Index('ix_bookings_property_id_start_date',
+                 'property_id', 'start_date'),
+        db.Index('ix_bookings_username_start_date',
+                 'username', 'start_date'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -219,9 +613,10 @@ class Booking(db.Model):
         autoincrement=True
     )
 
-    address = db.Column(
-        db.String,
-        db.ForeignKey('properties.address', ondelete='CASCADE')
+    property_id = db.Column(
+        db.Integer,
+        db.ForeignKey('properties.id', ondelete='CASCADE'),
+        nullable=False
     )
 
     username = db.Column(
@@ -244,6 +639,13 @@ class Booking(db.Model):
         nullable=False
     )
 
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow
+    )
+
     # review = db.Column(
     #     db.String
     # )
@@ -252,52 +654,192 @@ class Booking(db.Model):
     #     db.Integer
     # )
 
-    def serialize(self):
-        """Serialize to dictionary."""
+    def serialize(self, property=None):
+        """Serialize to dictionary.
+
+        Pass `property` when the caller already has it loaded, otherwise
+        load bookings through with_property() to avoid a lazy load each.
+        """
+
+        property = property or self.property
 
         return {
             "id":self.id,
-            "address":self.address,
+            "property_id": self.property_id,
+            "address": property.address,
             "customer": self.username,
             "total_price": self.total_price,
             "start_date": self.start_date,
             "end_date": self.end_date,
-            "property": self.property.serialize()
+            "property": property.serialize()
         }
 
+    @classmethod
+    def serialize_many(cls, bookings, property=None):
+        """Serialize a list of bookings, signing their properties' images
+        in bulk.
+        """
+
+        bookings = list(bookings)
+        Property.sign_images([property] if property
+                             else {b.property for b in bookings})
+        return [b.serialize(property=property) for b in bookings]
+
+    @classmethod
+    def collection_version(cls, *criterion):
+        """Return (row count, newest updated_at) for the bookings matching
+        `criterion`.
+
+        Serialized bookings embed their property, so the property's
+        updated_at counts too.
+        """
+
+        count, booked, listed = (
+            db.session.query(db.func.count(cls.id),
+                             db.func.max(cls.updated_at),
+                             db.func.max(Property.updated_at))
+            .select_from(cls)
+            .join(cls.property)
+            .filter(*criterion)
+            .one()
+        )
+
+        return count, max(filter(None, (booked, listed)), default=None)
+
+    @classmethod
+    def with_property(cls):
+        """Query bookings with their property joined in for serialize()."""
+
+        return cls.query.options(joinedload(cls.property))
+
+
+    @classmethod
+    def overlap_criteria(cls, start_date, end_date):
+        """Return the WHERE clauses for bookings overlapping the dates.
+
+        No booking is longer than MAX_STAY_DAYS, so one that overlaps
+        starts no earlier than that before start_date; the extra bound
+        keeps the index range scan to that window.
+        """
+
+        return (cls.start_date >= start_date - timedelta(days=MAX_STAY_DAYS),
+                cls.start_date <= end_date,
+                cls.end_date >= start_date)
 
     @classmethod
     def verify_dates(cls, start_date, end_date, property_id, booking_id=None):
         """Verifies:
                 -start_date < end_date
+                -the stay is at most MAX_STAY_DAYS long
                 -dates do not coincide with any other booking dates
+
+        Overlaps are found with a single query on the bookings index, so
+        only conflicting rows are fetched.
         """
         if (start_date > end_date):
             raise ValueError()
 
-        property_bookings = Property.query.get_or_404(property_id).bookings
-        filtered_bookings = [b_filter for b_filter in property_bookings
-                             if b_filter.id != booking_id]
+        if (end_date - start_date).days > MAX_STAY_DAYS:
+            raise ValueError()
+
+        conflicts = (
+            db.session.query(cls.id)
+            .filter(cls.property_id == property_id,
+                    *cls.overlap_criteria(start_date, end_date))
+        )
 
-        dates_validated = all(
-                ((start_date < b.start_date and end_date < b.start_date)
-            or (start_date > b.end_date and end_date > b.end_date))
-                for b in filtered_bookings
-                )
+        if booking_id is not None:
+            conflicts = conflicts.filter(cls.id != booking_id)
 
-        if (not dates_validated):
+        if (conflicts.first() is not None):
             raise MemoryError()
 
-        return dates_validated
+        return True
+
+    @classmethod
+    def batch_conflicts(cls, stays):
+        """Return the indexes of `stays` that overlap an existing booking.
+
+        `stays` is a list of (property_id, start_date, end_date). All of
+        them are checked in one query joining the requested ranges
+        against the bookings index.
+        """
+
+        if not stays:
+            return set()
+
+        # earliest: the lowest start_date an overlapping booking can have
+        # (see overlap_criteria).
+        max_stay = timedelta(days=MAX_STAY_DAYS)
+        rows = [(i, property_id, start_date - max_stay, start_date, end_date)
+                for i, (property_id, start_date, end_date) in enumerate(stays)]
+
+        if db.engine.dialect.name == "postgresql":
+            requested = values(
+                db.column("idx", db.Integer),
+                db.column("property_id", db.Integer),
+                db.column("earliest", db.DateTime),
+                db.column("start_date", db.DateTime),
+                db.column("end_date", db.DateTime),
+                name="requested",
+            ).data(rows)
+        else:
+            # VALUES with column aliases is Postgres syntax.
+            requested = union_all(*[
+                db.select(literal(i).label("idx"),
+                          literal(property_id).label("property_id"),
+                          literal(earliest).label("earliest"),
+                          literal(start_date).label("start_date"),
+                          literal(end_date).label("end_date"))
+                for i, property_id, earliest, start_date, end_date in rows
+            ]).subquery("requested")
+
+        conflicts = (
+            db.select(requested.c.idx)
+            .join(cls, db.and_(cls.property_id == requested.c.property_id,
+                               cls.start_date >= requested.c.earliest,
+                               cls.start_date <= requested.c.end_date,
+                               cls.end_date >= requested.c.start_date))
+            .distinct()
+        )
+
+        return set(db.session.scalars(conflicts))
+
+    @classmethod
+    def date_ranges(cls, property_id):
+        """Return (start_date, end_date) of every booking for a property."""
+
+        return (
+            db.session.query(cls.start_date, cls.end_date)
+            .filter(cls.property_id == property_id)
+            .all()
+        )
+
+    @classmethod
+    def is_available(cls, property_id, start_date, end_date):
+        """Check the cached availability bitmap for a property."""
+
+        bitmap = availability.get_bitmap(property_id, cls.date_ranges)
+        return bitmap.is_free(start_date, end_date)
 
     @classmethod
-    def add_booking(cls, address, username, total_price, start_date, end_date):
+    def calendar(cls, property_id, start_date, end_date):
+        """Return the cached interval index's [(date, booked)] for every
+        day from start_date to end_date.
+        """
+
+        intervals = availability.get_intervals(property_id, cls.date_ranges)
+        return intervals.days(start_date, end_date)
+
+    @classmethod
+    def add_booking(cls, property_id, username, total_price, start_date,
+                    end_date):
         """Creates property listing.
 
         Adds property to database
         """
         booking = Booking(
-            address=address,
+            property_id=property_id,
             username=username,
             total_price=total_price,
             start_date=start_date,
@@ -306,7 +848,16 @@ class Booking(db.Model):
 
         db.session.add(booking)
         db.session.commit()
+        availability.invalidate(property_id)
         return booking
 
 
 
+
+
+# Overlap checks rely on MAX_STAY_DAYS (see Booking.overlap_criteria), so
+# Postgres enforces it on every write path, not just the views.
+event.listen(Booking.__table__, "after_create", DDL(
+    "ALTER TABLE bookings ADD CONSTRAINT ck_bookings_stay_length "
+    f"CHECK (end_date - start_date <= interval '{MAX_STAY_DAYS} days')"
+).execute_if(dialect="postgresql"))
@@ -0,0 +1,115 @@
+"""Password hashing for SharenBn.
+
+bcrypt is deliberately slow, so its cost (BCRYPT_LOG_ROUNDS) is tunable
+and the work can be moved off the request thread. BCRYPT_EXECUTOR picks
+where hashing runs:
+
+    inline   in the calling thread (the default)
+    thread   in a bounded thread pool; bcrypt releases the GIL, so this
+             caps concurrent hashing at BCRYPT_WORKERS without blocking
+             other requests' Python code
+    process  in a bounded process pool, isolating the CPU work entirely
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
+import bcrypt
+
+BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+BCRYPT_EXECUTOR = os.environ.get('BCRYPT_EXECUTOR', 'inline')
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 1))
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('UTF-8'),
+                         bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(password.encode('UTF-8'), pw_hash.encode('UTF-8'))
+
+
+def _get_executor():
+    """Return this process's hashing pool, or None when running inline."""
+
+    if BCRYPT_EXECUTOR == 'inline':
+        return None
+
+    pid = os.getpid()
+
+    with _pool_lock:
+        if _pool.get('pid') != pid:
+            if BCRYPT_EXECUTOR == 'process':
+                # spawn, not fork: workers are multithreaded, and a forked
+                # child can deadlock on a lock another thread held.
+                executor = ProcessPoolExecutor(
+                    max_workers=BCRYPT_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            elif BCRYPT_EXECUTOR == 'thread':
+                executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS,
+                                              thread_name_prefix='bcrypt')
+            else:
+                raise ValueError(f'Unknown BCRYPT_EXECUTOR: {BCRYPT_EXECUTOR}')
+
+            _pool.clear()
+            _pool.update(pid=pid, executor=executor)
+
+        return _pool['executor']
+
+
+def _run(fn, *args):
+    executor = _get_executor()
+
+    if executor is None:
+        return fn(*args)
+
+    return executor.submit(fn, *args).result()
+
+
+def hash_password(password, rounds=None):
+    """Return a bcrypt hash of `password` at the configured cost."""
+
+    return _run(_hash, password, rounds or BCRYPT_LOG_ROUNDS)
+
+
+def check_password(pw_hash, password):
+    """Return True if `password` matches `pw_hash`."""
+
+    return _run(_check, pw_hash, password)
+
+
+def hash_many(passwords, rounds=None, executor=None):
+    """Hash many passwords, in parallel when an executor is configured
+    or passed in.
+
+    Yields hashes in input order.
+    """
+
+    rounds = rounds or BCRYPT_LOG_ROUNDS
+    executor = executor or _get_executor()
+
+    if executor is None:
+        return (_hash(password, rounds) for password in passwords)
+
+    return executor.map(_hash, passwords, repeat(rounds))
+
+
+def needs_rehash(pw_hash, rounds=None):
+    """Return True if `pw_hash` was made at a cost other than the
+    configured one.
+    """
+
+    try:
+        cost = int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+
+    return cost != (rounds or BCRYPT_LOG_ROUNDS)
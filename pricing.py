@@ -0,0 +1,204 @@
+"""Stay pricing for SharenBn.
+
+A stay is charged per night, from start_date up to (not including)
+end_date. Each night costs the property's price_rate times
+
+    * its weekday multiplier (Monday first)
+    * the multiplier of the season the night falls in, if any; seasons
+      recur yearly, run from "MM-DD" to "MM-DD" inclusive, may wrap the
+      new year, and later seasons win where they overlap
+
+and the sum is reduced by the monthly or weekly discount for stays of
+MONTHLY_NIGHTS / WEEKLY_NIGHTS or more. Nightly rates are rounded to
+cents and totals to whole currency units.
+
+quote_many() prices any number of stays in one pass: it builds a
+(property x day) array of nightly rates over the span the stays cover,
+takes running sums along each row, and reads every total off as the
+difference of two sums.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+WEEKLY_NIGHTS = 7
+MONTHLY_NIGHTS = 28
+MAX_SEASONS = 24
+
+# Day-of-year offsets of each month in a leap year, so "02-29" has a slot.
+MONTH_OFFSETS = np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+DEFAULT_RULES = {
+    "weekday_multipliers": [1.0] * 7,
+    "seasons": [],
+    "weekly_discount": 0.0,
+    "monthly_discount": 0.0,
+}
+
+
+def _positive(value, name):
+    if (not isinstance(value, (int, float)) or isinstance(value, bool)
+            or value <= 0):
+        raise ValueError(f"{name} must be a positive number")
+
+    return float(value)
+
+
+def _discount(value, name):
+    if (not isinstance(value, (int, float)) or isinstance(value, bool)
+            or not 0 <= value < 1):
+        raise ValueError(f"{name} must be at least 0 and below 1")
+
+    return float(value)
+
+
+def _day_of_year(month_day):
+    """Return the leap-year day index (0-365) of an "MM-DD" string."""
+
+    try:
+        date = datetime.strptime(f"2000-{month_day}", "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid season date {month_day!r}, use MM-DD")
+
+    return date.timetuple().tm_yday - 1
+
+
+def parse_rules(data):
+    """Validate pricing rules from a request body.
+
+    Missing keys fall back to DEFAULT_RULES. Returns the normalized rules
+    or raises ValueError describing the first problem.
+    """
+
+    if not isinstance(data, dict):
+        raise ValueError("Pricing rules must be an object")
+
+    unknown = set(data) - set(DEFAULT_RULES)
+    if unknown:
+        raise ValueError(f"Unknown pricing rules: {', '.join(sorted(unknown))}")
+
+    weekdays = data.get("weekday_multipliers",
+                        DEFAULT_RULES["weekday_multipliers"])
+    if not isinstance(weekdays, list) or len(weekdays) != 7:
+        raise ValueError("weekday_multipliers must list 7 numbers, Monday first")
+
+    seasons = data.get("seasons", [])
+    if not isinstance(seasons, list) or len(seasons) > MAX_SEASONS:
+        raise ValueError(f"seasons must be a list of at most {MAX_SEASONS}")
+
+    parsed_seasons = []
+    for season in seasons:
+        if not isinstance(season, dict):
+            raise ValueError("Each season needs start, end and multiplier")
+
+        _day_of_year(season.get("start"))
+        _day_of_year(season.get("end"))
+        parsed_seasons.append({
+            "start": season["start"],
+            "end": season["end"],
+            "multiplier": _positive(season.get("multiplier"),
+                                    "Season multiplier"),
+        })
+
+    return {
+        "weekday_multipliers": [_positive(m, "weekday_multipliers")
+                                for m in weekdays],
+        "seasons": parsed_seasons,
+        "weekly_discount": _discount(data.get("weekly_discount", 0.0),
+                                     "weekly_discount"),
+        "monthly_discount": _discount(data.get("monthly_discount", 0.0),
+                                      "monthly_discount"),
+    }
+
+
+def _season_table(seasons):
+    """Return the 366 per-day season multipliers for a property."""
+
+    table = np.ones(366)
+
+    for season in seasons:
+        start = _day_of_year(season["start"])
+        end = _day_of_year(season["end"])
+
+        if start <= end:
+            table[start:end + 1] = season["multiplier"]
+        else:
+            table[start:] = season["multiplier"]
+            table[:end + 1] = season["multiplier"]
+
+    return table
+
+
+def _as_day(value):
+    if isinstance(value, datetime):
+        value = value.date()
+
+    return np.datetime64(value, "D")
+
+
+def quote_many(stays):
+    """Price many stays at once.
+
+    `stays` is a list of (property, start_date, end_date); each property
+    needs id, price_rate and pricing (rules from parse_rules, or empty
+    for none). Returns the total prices, in order. Stays that end on or
+    before their start cost 0.
+    """
+
+    if not stays:
+        return []
+
+    # One row of rules per distinct property.
+    rows = {}
+    for property, _, _ in stays:
+        rows.setdefault(property.id, property)
+
+    row_of = {property_id: i for i, property_id in enumerate(rows)}
+    rules = [{**DEFAULT_RULES, **(property.pricing or {})}
+             for property in rows.values()]
+
+    price_rates = np.array([p.price_rate for p in rows.values()], dtype=float)
+    weekday_tables = np.array([r["weekday_multipliers"] for r in rules])
+    season_tables = np.array([_season_table(r["seasons"]) for r in rules])
+    weekly = np.array([r["weekly_discount"] for r in rules])
+    monthly = np.array([r["monthly_discount"] for r in rules])
+
+    stay_rows = np.array([row_of[property.id] for property, _, _ in stays])
+    starts = np.array([_as_day(start) for _, start, _ in stays])
+    ends = np.maximum(np.array([_as_day(end) for _, _, end in stays]), starts)
+
+    # Every night any stay covers, with its weekday and leap-year day.
+    first = starts.min()
+    days = np.arange(first, ends.max())
+    weekdays = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+    months = days.astype("datetime64[M]")
+    day_of_year = (MONTH_OFFSETS[months.astype(np.int64) % 12]
+                   + (days - months).astype(np.int64))
+
+    # Nightly rates in whole cents, so the running sums are exact and a
+    # stay costs the same in any batch as on its own.
+    rates = np.rint(price_rates[:, None]
+                    * weekday_tables[:, weekdays]
+                    * season_tables[:, day_of_year]
+                    * 100).astype(np.int64)
+    running = np.zeros((len(rows), len(days) + 1), dtype=np.int64)
+    np.cumsum(rates, axis=1, out=running[:, 1:])
+
+    offsets = (starts - first).astype(np.int64)
+    nights = (ends - starts).astype(np.int64)
+    subtotals = (running[stay_rows, offsets + nights]
+                 - running[stay_rows, offsets])
+
+    discounts = np.where(nights >= MONTHLY_NIGHTS, monthly[stay_rows],
+                         np.where(nights >= WEEKLY_NIGHTS, weekly[stay_rows],
+                                  0.0))
+    totals = np.floor(subtotals * (1 - discounts) / 100 + 0.5)
+
+    return [int(total) for total in totals]
+
+
+def quote(property, start_date, end_date):
+    """Return the total price of one stay."""
+
+    return quote_many([(property, start_date, end_date)])[0]
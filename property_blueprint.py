@@ -0,0 +1,763 @@
+import math
+from datetime import datetime
+
+from flask import Blueprint, abort, jsonify, request
+from flask_jwt_extended import get_jwt_identity, jwt_required
+from sqlalchemy.exc import IntegrityError
+
+import availability
+import booking_locks
+import cache
+import conditional
+import geo
+import geocoding
+import image_pipeline
+import pricing
+import streaming
+from aws_s3 import Aws, MAX_MULTIPART_PARTS, MAX_UPLOAD_SIZE
+from models import (db, User, Property, Booking, MAX_STAY_DAYS,
+                    TIME_FORMAT)
+
+properties = Blueprint('properties', __name__)
+
+PROPERTY_PAGE_SIZE = 20
+MAX_PROPERTY_PAGE_SIZE = 100
+MAX_SEARCH_RADIUS_KM = 100
+MAX_QUOTES = 500
+MAX_QUOTE_SPAN_DAYS = 731
+MAX_CALENDAR_DAYS = 366
+
+
+def int_arg(args, name, default=None):
+    """Return query param `name` as an int, or `default` if it is missing
+    or not a number.
+
+    Works on any mapping of query params, so the ASGI views (asgi.py)
+    share these helpers.
+    """
+
+    try:
+        return int(args[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def page_limit(args):
+    """Return the requested page size, clamped to MAX_PROPERTY_PAGE_SIZE."""
+
+    limit = int_arg(args, "limit", PROPERTY_PAGE_SIZE)
+    return max(1, min(limit, MAX_PROPERTY_PAGE_SIZE))
+
+
+def filter_criteria(args):
+    """Return the Property WHERE clauses for the filter query params."""
+
+    return Property.filter_criteria(
+        min_price=int_arg(args, "min_price"),
+        max_price=int_arg(args, "max_price"),
+        min_sqft=int_arg(args, "min_sqft"),
+        max_sqft=int_arg(args, "max_sqft"),
+        owner=args.get("owner"),
+    )
+
+
+def filtered_properties(args):
+    """Return a Property query narrowed by the filter query params."""
+
+    return Property.query.filter(*filter_criteria(args))
+
+
+def date_range(args):
+    """Return (start_date, end_date) parsed from the query params.
+
+    Raises ValueError if either is missing or out of order.
+    """
+
+    try:
+        start_date = datetime.strptime(args["start_date"], TIME_FORMAT)
+        end_date = datetime.strptime(args["end_date"], TIME_FORMAT)
+    except (KeyError, ValueError):
+        raise ValueError("start_date and end_date (YYYY-MM-DD) are required")
+
+    if start_date > end_date:
+        raise ValueError("Start date is after end date.")
+
+    return start_date, end_date
+
+
+def coordinates(args, *names):
+    """Return the float query params `names`, in order.
+
+    Raises ValueError if any is missing or not a finite number.
+    """
+
+    values = [args.get(name, type=float) for name in names]
+
+    if None in values or not all(map(math.isfinite, values)):
+        raise ValueError(f"{', '.join(names)} are required numbers")
+
+    return values
+
+
+def form_location(form, address):
+    """Return (lat, lng) for a listing form.
+
+    Explicit latitude/longitude fields (e.g. a dropped map pin) win over
+    geocoding `address`. Returns None if the address can't be located;
+    raises ValueError for out-of-range coordinates.
+    """
+
+    lat = form.get("latitude", type=float)
+    lng = form.get("longitude", type=float)
+
+    if lat is None or lng is None:
+        return geocoding.geocode(address)
+
+    if not geo.is_valid(lat, lng):
+        raise ValueError("latitude/longitude out of range")
+
+    return lat, lng
+
+
+@properties.post("")
+@jwt_required()
+def add_property():
+    """Handles POST request for new property registration.
+
+    Create new property and add to DB. The image is either a `file` that
+    is uploaded to S3 here, or the `img_key` of a direct upload made with
+    POST /property/uploads.
+
+    Return JSON for newly created property
+    """
+
+    address = request.form.get("address")
+    sqft = request.form.get("sqft")
+    description = request.form.get("description")
+    owner = User.query.get_or_404(get_jwt_identity())
+    price_rate = request.form.get("price_rate")
+
+    img_file = request.files.get("file")
+    img_key = request.form.get("img_key")
+
+    size = (Aws.file_size(img_key)
+            if not img_file and Aws.is_user_upload(img_key, owner.username)
+            else None)
+
+    if img_file:
+        img_file_name = Aws.upload_file(img_file, owner.username)
+    elif size is None:
+        return jsonify({"error": "Image file or uploaded img_key required"}), 400
+    elif size > MAX_UPLOAD_SIZE:
+        return jsonify({"error": "Upload is too large"}), 400
+    else:
+        img_file_name = img_key
+
+    try:
+        location = form_location(request.form, address)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        property = Property.add_property(
+            address, price_rate, owner, sqft, img_file_name, description,
+            location=location
+        )
+        cache.invalidate_property(property.id)
+        image_pipeline.submit(property.id, property.img_key)
+        return (jsonify(property=property.serialize()), 201)
+
+    except IntegrityError:
+        error = f"Property address ({address}) already listed"
+        return jsonify({"error": error})
+
+
+@properties.post("/uploads")
+@jwt_required()
+def start_image_upload():
+    """Handles POST request for direct-to-S3 image upload credentials.
+
+    Form: file_name, content_type and optional parts (number of parts
+    for a multipart upload of a large image)
+
+    Return JSON with the object key and either presigned POST fields or
+    an upload id with one presigned PUT url per part
+    """
+
+    content_type = request.form.get("content_type", "image/jpeg")
+
+    if not content_type.startswith("image/"):
+        return jsonify({"error": "Only image uploads are allowed"}), 400
+
+    key = Aws.new_upload_key(get_jwt_identity(),
+                             request.form.get("file_name"))
+    parts = request.form.get("parts", type=int)
+
+    if parts is None:
+        upload = Aws.get_upload_post(key, content_type)
+        return jsonify(key=key, upload=upload), 201
+
+    if not 1 <= parts <= MAX_MULTIPART_PARTS:
+        return jsonify({"error": "Invalid number of parts"}), 400
+
+    upload_id, part_urls = Aws.start_multipart_upload(key, content_type, parts)
+    return jsonify(key=key, upload_id=upload_id, part_urls=part_urls), 201
+
+
+@properties.post("/uploads/complete")
+@jwt_required()
+def complete_image_upload():
+    """Handles POST request to finish a multipart image upload.
+
+    JSON body: {key, upload_id, parts: [{PartNumber, ETag}, ...]}
+
+    Return JSON with the completed object key
+    """
+
+    data = request.get_json(silent=True) or {}
+    key = data.get("key")
+    upload_id = data.get("upload_id")
+    parts = data.get("parts")
+
+    if not Aws.is_user_upload(key, get_jwt_identity()):
+        return jsonify({"error": "Invalid Authorization"})
+
+    if not upload_id or not parts:
+        return jsonify({"error": "upload_id and parts are required"}), 400
+
+    try:
+        Aws.complete_multipart_upload(key, upload_id, parts)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(key=key)
+
+
+@properties.post("/quotes")
+def quote_stays():
+    """Handles POST request to price many stays without booking them.
+
+    JSON body: {quotes: [{property_id, start_date, end_date}, ...]} with
+    up to MAX_QUOTES stays, dates YYYY-MM-DD, all within
+    MAX_QUOTE_SPAN_DAYS of each other
+
+    Return JSON with one quote per stay, in order; unknown properties get
+    an error instead of a price
+    """
+
+    data = request.get_json(silent=True) or {}
+    items = data.get("quotes")
+
+    if not isinstance(items, list) or not 1 <= len(items) <= MAX_QUOTES:
+        return jsonify({"error": f"quotes must list 1 to {MAX_QUOTES} stays"}), 400
+
+    try:
+        stays = [(int(item["property_id"]),
+                  datetime.strptime(item["start_date"], TIME_FORMAT),
+                  datetime.strptime(item["end_date"], TIME_FORMAT))
+                 for item in items]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Each quote needs property_id, "
+                                 "start_date and end_date (YYYY-MM-DD)"}), 400
+
+    if any(start > end for _, start, end in stays):
+        return jsonify({"error": "Start date is after end date."}), 400
+
+    span = (max(end for _, _, end in stays)
+            - min(start for _, start, _ in stays)).days
+    if span > MAX_QUOTE_SPAN_DAYS:
+        return jsonify({"error": "Quoted dates span too long"}), 400
+
+    rows = (db.session.query(Property.id, Property.price_rate,
+                             Property.pricing)
+            .filter(Property.id.in_({property_id
+                                     for property_id, _, _ in stays}))
+            .all())
+    by_id = {row.id: row for row in rows}
+
+    found = [(by_id[property_id], start, end)
+             for property_id, start, end in stays if property_id in by_id]
+    totals = iter(pricing.quote_many(found))
+
+    quotes = []
+    for property_id, start, end in stays:
+        quote = {
+            "property_id": property_id,
+            "start_date": start.strftime(TIME_FORMAT),
+            "end_date": end.strftime(TIME_FORMAT),
+        }
+
+        if property_id in by_id:
+            quote["nights"] = (end - start).days
+            quote["total_price"] = next(totals)
+        else:
+            quote["error"] = "Property not found"
+
+        quotes.append(quote)
+
+    return jsonify(quotes=quotes)
+
+
+@properties.get("")
+def get_all_properties():
+    """handles GET request to read a page of properties
+
+    Optional query params:
+        cursor: id of the last property on the previous page
+        limit: page size (capped at MAX_PROPERTY_PAGE_SIZE)
+        min_price, max_price, min_sqft, max_sqft, owner: filters
+        stream: if set, ignore cursor/limit and stream every match
+
+    Return JSON array for the page and the cursor for the next one
+    """
+
+    criteria = filter_criteria(request.args)
+    query = Property.query.filter(*criteria)
+    cursor = request.args.get("cursor", type=int)
+    limit = page_limit(request.args)
+
+    # A streamed response holds every match; a page only its own rows.
+    if streaming.wants_stream(request.args):
+        version = Property.collection_version(criteria)
+    else:
+        version = Property.collection_version(criteria, cursor, limit)
+
+    updated_at = version[-1]
+    etag = conditional.make_etag("properties", request.query_string,
+                                 *version)
+
+    def build_page():
+        properties, next_cursor = Property.page_after(
+            query, cursor=cursor, limit=limit)
+        return {"properties": Property.serialize_many(properties),
+                "next_cursor": next_cursor}
+
+    def build():
+        if streaming.wants_stream(request.args):
+            return streaming.stream_json("properties",
+                                         query.order_by(Property.id),
+                                         Property.serialize_many)
+
+        key = cache.listing_key(request.args.items(multi=True), version)
+        return cache.cached_json(key, build_page)
+
+    return conditional.respond(etag, updated_at, build)
+
+
+@properties.get("/available")
+def get_available_properties():
+    """handles GET request to search properties free for a date range
+
+    Required query params: start_date, end_date (YYYY-MM-DD)
+    Accepts the same filters and pagination params as GET /property
+
+    Return JSON array for the page and the cursor for the next one
+    """
+
+    try:
+        start_date, end_date = date_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = filtered_properties(request.args)
+    query = Property.available(query, start_date, end_date)
+    properties, next_cursor = Property.page_after(
+        query,
+        cursor=request.args.get("cursor", type=int),
+        limit=page_limit(request.args),
+    )
+    serialized_properties = Property.serialize_many(properties)
+
+    return (jsonify(properties=serialized_properties,
+                    next_cursor=next_cursor), 200)
+
+
+@properties.get("/search")
+def search_properties():
+    """handles GET request for a keyword search of properties
+
+    Required query param q: search terms for address and description
+    (supports "quoted phrases", or, and -excluded words)
+    Optional query params: cursor, limit and the GET /property filters
+
+    Return JSON array of the best matches first, and the cursor for the
+    next page
+    """
+
+    terms = request.args.get("q", "").strip()
+
+    if not terms:
+        return jsonify({"error": "q is required"}), 400
+
+    if db.engine.dialect.name != "postgresql":
+        return jsonify({"error": "Search requires Postgres"}), 501
+
+    try:
+        properties, next_cursor = Property.search_page(
+            filtered_properties(request.args),
+            terms,
+            cursor=request.args.get("cursor"),
+            limit=page_limit(request.args),
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    serialized_properties = Property.serialize_many(properties)
+
+    return (jsonify(properties=serialized_properties,
+                    next_cursor=next_cursor), 200)
+
+
+@properties.get("/geo")
+def search_properties_by_location():
+    """handles GET request to search properties on a map
+
+    Either a radius search:
+        lat, lng: centre point
+        radius_km: distance from it (capped at MAX_SEARCH_RADIUS_KM)
+    or a bounding box, e.g. the visible map area:
+        min_lat, min_lng, max_lat, max_lng (min_lng > max_lng crosses
+        the antimeridian), paginated like GET /property
+    Accepts the same filters as GET /property
+
+    Return JSON array of properties; radius results come nearest first,
+    each with its distance_km
+    """
+
+    query = filtered_properties(request.args)
+
+    try:
+        if "radius_km" in request.args:
+            lat, lng, radius_km = coordinates(
+                request.args, "lat", "lng", "radius_km")
+            if not geo.is_valid(lat, lng) or radius_km <= 0:
+                raise ValueError("lat/lng out of range or radius_km <= 0")
+        else:
+            min_lat, min_lng, max_lat, max_lng = coordinates(
+                request.args, "min_lat", "min_lng", "max_lat", "max_lng")
+            if (not geo.is_valid(min_lat, min_lng)
+                    or not geo.is_valid(max_lat, max_lng)
+                    or min_lat > max_lat):
+                raise ValueError("Bounding box out of range")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if "radius_km" in request.args:
+        nearest = Property.nearest(
+            query, lat, lng, min(radius_km, MAX_SEARCH_RADIUS_KM),
+            limit=page_limit(request.args),
+        )
+        serialized_properties = Property.serialize_many(
+            p for p, _ in nearest)
+        for serialized, (_, distance) in zip(serialized_properties, nearest):
+            serialized["distance_km"] = round(distance, 3)
+
+        return (jsonify(properties=serialized_properties), 200)
+
+    query = Property.within(query, min_lat, min_lng, max_lat, max_lng)
+    properties, next_cursor = Property.page_after(
+        query,
+        cursor=request.args.get("cursor", type=int),
+        limit=page_limit(request.args),
+    )
+    serialized_properties = Property.serialize_many(properties)
+
+    return (jsonify(properties=serialized_properties,
+                    next_cursor=next_cursor), 200)
+
+
+@properties.get("/<int:property_id>")
+def get_property(property_id):
+    """handles GET request to read specific property based on id
+
+    Return JSON for searched property
+    """
+
+    updated_at = Property.version(property_id)
+
+    if updated_at is None:
+        abort(404)
+
+    def build_property():
+        property = Property.query.get_or_404(property_id)
+        return {"property": property.serialize()}
+
+    def build():
+        return cache.cached_json(cache.property_key(property_id, updated_at),
+                                 build_property)
+
+    etag = conditional.make_etag("property", property_id, updated_at)
+    return conditional.respond(etag, updated_at, build)
+
+
+@properties.patch("/<int:property_id>")
+@jwt_required()
+def edit_property(property_id):
+    """handles PATCH request to edit specific property based on id
+
+    Return JSON for newly updated property
+    """
+
+    property = Property.query.get_or_404(property_id)
+
+    current_user = get_jwt_identity()
+
+    if current_user != property.user:
+        return jsonify(error="Invalid Authorization")
+
+    address = request.form.get("address", property.address)
+
+    if (address != property.address or "latitude" in request.form
+            or "longitude" in request.form):
+        try:
+            location = form_location(request.form, address)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        property.set_location(*(location or (None, None)))
+
+    property.address = address
+    property.sqft = request.form.get("sqft", property.sqft)
+    property.price_rate = request.form.get("price_rate", property.price_rate)
+    property.description = request.form.get(
+        "description", property.description)
+
+    img_file = request.files.get("file")
+
+    if img_file:
+        property.set_image(Aws.upload_file(img_file, current_user))
+
+    try:
+        db.session.commit()
+        cache.invalidate_property(property.id)
+        if img_file:
+            image_pipeline.submit(property.id, property.img_key)
+        serialized_updated_property = property.serialize()
+        return jsonify(property=serialized_updated_property)
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": f"Duplicate address: {property.address}"})
+
+
+@properties.put("/<int:property_id>/image")
+@jwt_required()
+def attach_property_image(property_id):
+    """Handles PUT request to attach a direct upload to a property
+
+    Form: key returned by POST /property/uploads once the upload is done
+
+    Uploads over MAX_UPLOAD_SIZE are refused here, since nothing caps the
+    parts of a multipart upload the way the presigned POST policy does.
+
+    Return JSON for the updated property
+    """
+
+    property = Property.query.get_or_404(property_id)
+    current_user = get_jwt_identity()
+
+    if current_user != property.user:
+        return jsonify(error="Invalid Authorization")
+
+    key = request.form.get("key")
+
+    if not Aws.is_user_upload(key, current_user):
+        return jsonify({"error": "Invalid Authorization"})
+
+    size = Aws.file_size(key)
+
+    if size is None:
+        return jsonify({"error": "Upload not found"}), 404
+
+    if size > MAX_UPLOAD_SIZE:
+        return jsonify({"error": "Upload is too large"}), 400
+
+    property.set_image(key)
+    db.session.commit()
+    cache.invalidate_property(property.id)
+    image_pipeline.submit(property.id, key)
+
+    return jsonify(property=property.serialize())
+
+
+@properties.delete("/<int:property_id>")
+@jwt_required()
+def delete_property(property_id):
+    """handles DELETE request to delete specific property based on id
+
+    Return JSON for confirmation message
+    """
+
+    property = Property.query.get_or_404(property_id)
+
+    current_user = get_jwt_identity()
+
+    if current_user != property.user:
+        return jsonify({"error": "Invalid Authorization"})
+
+    # Its bookings go with it via ON DELETE CASCADE.
+    db.session.delete(property)
+    db.session.commit()
+    cache.invalidate_property(property_id)
+    availability.invalidate(property_id)
+
+    return jsonify(deleted=property.address)
+
+
+@properties.put("/<int:property_id>/pricing")
+@jwt_required()
+def set_property_pricing(property_id):
+    """Handles PUT request to replace a property's pricing rules
+
+    JSON body: {weekday_multipliers: [7 numbers, Monday first],
+                seasons: [{start: "MM-DD", end: "MM-DD", multiplier}],
+                weekly_discount, monthly_discount} (all optional)
+
+    Return JSON of the saved rules
+    """
+
+    property = Property.query.get_or_404(property_id)
+
+    if get_jwt_identity() != property.user:
+        return jsonify({"error": "Invalid Authorization"})
+
+    try:
+        rules = pricing.parse_rules(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    property.pricing = rules
+    db.session.commit()
+
+    return jsonify(pricing=rules)
+
+
+@properties.get("/<int:property_id>/availability")
+def get_property_availability(property_id):
+    """Given a property id and start_date/end_date query params
+    Return JSON of whether the property is free for those dates
+    """
+
+    property = Property.query.get_or_404(property_id)
+
+    try:
+        start_date, end_date = date_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    is_available = Booking.is_available(property.id, start_date, end_date)
+    return jsonify(available=is_available)
+
+
+@properties.get("/<int:property_id>/calendar")
+def get_property_calendar(property_id):
+    """Given a property id and start_date/end_date query params (at most
+    MAX_CALENDAR_DAYS apart)
+    Return JSON of every day in that window and whether it is booked
+    """
+
+    if not db.session.query(
+            Property.query.filter_by(id=property_id).exists()).scalar():
+        abort(404)
+
+    try:
+        start_date, end_date = date_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if (end_date - start_date).days >= MAX_CALENDAR_DAYS:
+        return jsonify({"error": "Calendar window is too long"}), 400
+
+    days = Booking.calendar(property_id, start_date, end_date)
+
+    return jsonify(
+        property_id=property_id,
+        start_date=start_date.strftime(TIME_FORMAT),
+        end_date=end_date.strftime(TIME_FORMAT),
+        days=[{"date": day.strftime(TIME_FORMAT), "booked": booked}
+              for day, booked in days],
+    )
+
+
+############### BOOKING ################
+
+
+@properties.post("/<int:property_id>/bookings")
+@jwt_required()
+def book_property(property_id):
+    """Given property Id
+    Create a booking in the DB
+    return JSON with booking info
+    """
+
+    property = Property.query.get_or_404(property_id)
+    start_date_str = request.form.get("start_date")
+    end_date_str = request.form.get("end_date")
+
+    start_date = datetime.strptime(start_date_str, TIME_FORMAT)
+    end_date = datetime.strptime(end_date_str, TIME_FORMAT)
+    current_user = get_jwt_identity()
+
+    if current_user == property.user:
+        return jsonify({"error": "Owner cannot book own property"})
+
+    if (end_date - start_date).days > MAX_STAY_DAYS:
+        return jsonify({"error": f"Stays are limited to {MAX_STAY_DAYS} "
+                                 "days."}), 400
+
+    def write():
+        Booking.verify_dates(start_date=start_date,
+                             end_date=end_date,
+                             property_id=property.id)
+
+        return Booking.add_booking(
+            property_id=property.id,
+            username=current_user,
+            total_price=pricing.quote(property, start_date, end_date),
+            start_date=start_date,
+            end_date=end_date,
+        )
+
+    try:
+        booking = booking_locks.run_locked([property.id], write)
+        return jsonify(booking=booking.serialize())
+    except ValueError:
+        return jsonify({"error":'Start date is after end date.'}), 500
+        # return jsonify(error="start date is after end date")
+    except MemoryError:
+        return jsonify({"error":'Dates are already booked.'}), 500
+        # return jsonify(error="dates are already booked")
+    except booking_locks.PropertyBusy:
+        return jsonify({"error": "Property is busy, try again."}), 409
+
+
+@properties.get("/<int:property_id>/bookings")
+@jwt_required()
+def get_property_bookings(property_id):
+    """Given a property id
+    Return JSON of all the property bookings
+
+    Optional query param stream: stream the bookings in chunks
+    """
+    property = Property.query.get_or_404(property_id)
+
+    if get_jwt_identity() != property.user:
+        return jsonify({"error": "Invalid Authorization"})
+
+    bookings = (Booking.query
+                .filter_by(property_id=property.id)
+                .order_by(Booking.start_date, Booking.id))
+    count, updated_at = Booking.collection_version(
+        Booking.property_id == property.id)
+    etag = conditional.make_etag("property-bookings", property.id,
+                                 request.query_string, count, updated_at)
+
+    def serialize_many(chunk):
+        return Booking.serialize_many(chunk, property=property)
+
+    def build():
+        if streaming.wants_stream(request.args):
+            return streaming.stream_json("bookings", bookings, serialize_many)
+
+        return jsonify(bookings=serialize_many(bookings))
+
+    return conditional.respond(etag, updated_at, build)
@@ -0,0 +1,145 @@
+"""Chunked background deletion of large accounts.
+
+Deleting a user cascades, in the database, to their properties and to
+every booking on or by them. For a host with thousands of listings that
+is one long transaction holding locks on all of those rows, so accounts
+with more than PURGE_THRESHOLD properties and bookings are removed in the
+background instead: PURGE_CHUNK_SIZE rows per transaction, bookings the
+user made first, then their properties (whose bookings cascade), then the
+user row itself, which also takes anything created in the meantime.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+import availability
+import cache
+from models import db, User, Property, Booking
+
+PURGE_THRESHOLD = int(os.environ.get('PURGE_THRESHOLD', 1000))
+PURGE_CHUNK_SIZE = int(os.environ.get('PURGE_CHUNK_SIZE', 500))
+
+logger = logging.getLogger(__name__)
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def account_size(username):
+    """Return how many properties and bookings belong to `username`."""
+
+    properties = db.select(db.func.count()).where(Property.user == username)
+    bookings = db.select(db.func.count()).where(Booking.username == username)
+
+    return db.session.scalar(
+        db.select(properties.scalar_subquery() + bookings.scalar_subquery()))
+
+
+def is_large(username):
+    return account_size(username) > PURGE_THRESHOLD
+
+
+def delete_bookings_chunk(username, chunk_size):
+    """Delete up to `chunk_size` bookings made by `username`.
+
+    Returns the ids of the properties they were on.
+    """
+
+    chunk = (db.select(Booking.id, Booking.property_id)
+             .where(Booking.username == username)
+             .limit(chunk_size))
+    rows = db.session.execute(chunk).all()
+
+    if rows:
+        db.session.execute(db.delete(Booking).where(
+            Booking.id.in_([booking_id for booking_id, _ in rows])))
+
+    return {property_id for _, property_id in rows}
+
+
+def delete_properties_chunk(username, chunk_size):
+    """Delete up to `chunk_size` of `username`'s properties and, through
+    the foreign key cascade, their bookings. Returns the property ids.
+    """
+
+    property_ids = db.session.scalars(
+        db.select(Property.id)
+        .where(Property.user == username)
+        .limit(chunk_size)).all()
+
+    if property_ids:
+        db.session.execute(db.delete(Property).where(
+            Property.id.in_(property_ids)))
+
+    return set(property_ids)
+
+
+def purge_user(username, chunk_size=PURGE_CHUNK_SIZE):
+    """Delete a user and everything they own, one chunk per transaction.
+
+    Must be called inside an app context. Returns the number of
+    transactions it took.
+    """
+
+    transactions = 0
+
+    for delete_chunk, owned in ((delete_bookings_chunk, False),
+                                (delete_properties_chunk, True)):
+        while True:
+            property_ids = delete_chunk(username, chunk_size)
+            db.session.commit()
+            transactions += 1
+
+            if not property_ids:
+                break
+
+            for property_id in property_ids:
+                availability.invalidate(property_id)
+            if owned:
+                cache.invalidate_properties(property_ids)
+
+    db.session.execute(db.delete(User).where(User.username == username))
+    db.session.commit()
+
+    return transactions + 1
+
+
+def _get_pool():
+    """Return this process's purge thread, creating it on first use so
+    forked servers never inherit it.
+    """
+
+    pid = os.getpid()
+
+    with _pool_lock:
+        if _pool.get('pid') != pid:
+            _pool['pid'] = pid
+            _pool['threads'] = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='purge')
+
+        return _pool['threads']
+
+
+def submit(username):
+    """Queue purge_user(username) in the background.
+
+    Must be called inside an app context. Returns a Future.
+    """
+
+    app = current_app._get_current_object()
+    return _get_pool().submit(_run, app, username)
+
+
+def _run(app, username):
+    with app.app_context():
+        try:
+            transactions = purge_user(username)
+            logger.info('Purged %s in %d transactions', username, transactions)
+        except Exception:
+            db.session.rollback()
+            logger.exception('Purge failed for %s', username)
+            raise
@@ -0,0 +1,171 @@
+"""Garbage collection of unreferenced property images in S3.
+
+    flask s3 gc --dry-run
+    flask s3 gc --min-age 86400 --rate 5
+    flask s3 gc --dry-run --include-legacy
+
+Replacing a property's image or deleting the property leaves its objects
+in the bucket. This walks the uploads/ and images/ prefixes one listing
+page at a time, skips every key a property's img_key or img_variants
+still points at, and removes the rest with batched delete_objects calls,
+at most --rate of them per second.
+
+Images uploaded before those prefixes existed sit at the bucket root.
+They are only scanned with --include-legacy, and other prefixes only when
+named with --prefix (which replaces the default two); run with --dry-run
+first, since anything there that no property references is deleted.
+
+Objects younger than --min-age are never touched: they may be direct
+uploads whose property hasn't been created yet, or image-pipeline output
+that hasn't been committed yet. Each batch is also re-checked against the
+database just before it is deleted, since a new upload of the same file
+makes a content-addressed image referenced again.
+
+Set AWS_S3_ENDPOINT_URL to run against a local S3 stand-in such as MinIO.
+"""
+
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+import click
+from flask.cli import AppGroup
+
+from aws_s3 import Aws, UPLOAD_PREFIX
+from image_pipeline import IMAGE_PREFIX
+from models import db, Property
+
+DELETE_BATCH_SIZE = 1000  # the most keys one delete_objects call takes
+DELETE_RATE = 5  # delete_objects calls per second
+MIN_AGE_SECONDS = 24 * 60 * 60
+CHUNK_SIZE = 5000
+DEFAULT_PREFIXES = (UPLOAD_PREFIX, IMAGE_PREFIX)
+
+s3_cli = AppGroup("s3", help="S3 bucket maintenance.")
+
+
+def image_keys(rows):
+    """Yield every object key in (img_key, img_variants) rows."""
+
+    for img_key, variants in rows:
+        yield img_key
+        yield from (variants or {}).values()
+
+
+def referenced_keys():
+    """Return the set of object keys any property points at."""
+
+    rows = db.session.execute(
+        db.select(Property.img_key, Property.img_variants),
+        execution_options={"yield_per": CHUNK_SIZE})
+    keys = set(image_keys(rows))
+    db.session.close()
+
+    return keys
+
+
+def still_referenced(keys):
+    """Return the subset of `keys` that properties point at right now.
+
+    Variants live in the same images/<sha256>/ directory as the original
+    named by img_key, so matching img_key against either the key or its
+    directory finds every property using it.
+    """
+
+    directories = defaultdict(set)
+    for key in keys:
+        if key.startswith(f"{IMAGE_PREFIX}/"):
+            directory = key.rsplit("/", 1)[0] + "/"
+            directories[len(directory)].add(directory)
+
+    rows = db.session.execute(
+        db.select(Property.img_key, Property.img_variants)
+        .where(db.or_(
+            Property.img_key.in_(keys),
+            *(db.func.substr(Property.img_key, 1, length).in_(prefixes)
+              for length, prefixes in directories.items()))))
+    in_use = set(keys) & set(image_keys(rows))
+    db.session.close()
+
+    return in_use
+
+
+def orphans(referenced, cutoff, prefixes=DEFAULT_PREFIXES,
+            include_legacy=False):
+    """Yield keys under `prefixes` (and, with `include_legacy`, at the
+    bucket root) that aren't in `referenced` and were last written before
+    `cutoff`.
+    """
+
+    listings = [Aws.list_files(f"{prefix.rstrip('/')}/")
+                for prefix in prefixes]
+    if include_legacy:
+        listings.append(Aws.list_files("", delimiter="/"))
+
+    for listing in listings:
+        for obj in listing:
+            if obj["Key"] not in referenced and obj["LastModified"] < cutoff:
+                yield obj["Key"]
+
+
+@s3_cli.command("gc")
+@click.option("--dry-run", is_flag=True,
+              help="Print the orphaned keys instead of deleting them.")
+@click.option("--min-age", default=MIN_AGE_SECONDS, show_default=True,
+              help="Seconds since an object was written before it may go.")
+@click.option("--rate", default=DELETE_RATE, type=click.FloatRange(min=0.01),
+              show_default=True, help="Most delete requests per second.")
+@click.option("--batch-size", default=DELETE_BATCH_SIZE, show_default=True,
+              type=click.IntRange(1, DELETE_BATCH_SIZE))
+@click.option("--prefix", "prefixes", multiple=True,
+              default=DEFAULT_PREFIXES, show_default=True,
+              help="Key prefix to scan; repeat for several.")
+@click.option("--include-legacy", is_flag=True,
+              help="Also scan keys at the bucket root.")
+def collect_garbage(dry_run, min_age, rate, batch_size, prefixes,
+                    include_legacy):
+    """Delete S3 objects no property references."""
+
+    if any(not prefix.strip("/") for prefix in prefixes):
+        raise click.BadParameter("use --include-legacy for the bucket root",
+                                 param_hint="--prefix")
+
+    started = time.perf_counter()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=min_age)
+    candidates = orphans(referenced_keys(), cutoff, prefixes, include_legacy)
+    deleted = failed = 0
+    last_request = 0
+
+    while True:
+        batch = list(islice(candidates, batch_size))
+        if not batch:
+            break
+
+        in_use = still_referenced(batch)
+        batch = [key for key in batch if key not in in_use]
+
+        if dry_run:
+            for key in batch:
+                click.echo(key)
+            deleted += len(batch)
+            continue
+
+        if not batch:
+            continue
+
+        time.sleep(max(0, last_request + 1 / rate - time.monotonic()))
+        last_request = time.monotonic()
+
+        errors = Aws.delete_files(batch)
+        for error in errors:
+            click.echo(f"Could not delete {error['Key']}: {error['Code']}",
+                       err=True)
+
+        deleted += len(batch) - len(errors)
+        failed += len(errors)
+
+    verb = "Would delete" if dry_run else "Deleted"
+    click.echo(f"{verb} {deleted} objects in "
+               f"{time.perf_counter() - started:.1f}s, {failed} failed",
+               err=True)
@@ -1,5 +1,3 @@
-from flask_expects_json import
-
 user_registration_schema = {
 
   "type": "object",
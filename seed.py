@@ -1,15 +1,16 @@
 from csv import DictReader
-from app import db
-from models import User, Property, Booking
-from flask_bcrypt import Bcrypt
+from app import create_app
+from models import db, User, Property, Booking
+from passwords import hash_password
 
-bcrypt = Bcrypt()
+app = create_app()
+app.app_context().push()
 
 db.drop_all()
 db.create_all()
 
 
-hashed_test_pswd = bcrypt.generate_password_hash('password').decode('UTF-8')
+hashed_test_pswd = hash_password('password')
 
 
 test_user1 = User(
@@ -0,0 +1,122 @@
+"""Per-request SQL instrumentation for SharenBn.
+
+Hooks SQLAlchemy engine events to count queries and time spent in the
+database for each request. Totals are sent back as X-DB-Query-Count and
+X-DB-Time-Ms headers and logged per request. Statements slower than
+SQL_SLOW_QUERY_MS are logged with the endpoint that ran them, and a
+statement repeated SQL_REPEAT_THRESHOLD or more times within one request
+is flagged as a likely N+1 (e.g. a lazy relationship loaded per row).
+"""
+
+import logging
+import time
+from collections import Counter
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_listening = False
+
+
+class RequestStats():
+    """SQL activity recorded during one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def repeated(self, threshold):
+        """Return [(statement, times)] run at least `threshold` times."""
+
+        return [(statement, times)
+                for statement, times in self.statements.most_common()
+                if times >= threshold]
+
+
+def init_app(app):
+    """Enable SQL profiling for `app` (skipped when SQL_PROFILER is off)."""
+
+    app.config.setdefault("SQL_PROFILER", True)
+    app.config.setdefault("SQL_SLOW_QUERY_MS", 200)
+    app.config.setdefault("SQL_REPEAT_THRESHOLD", 5)
+
+    if not app.config["SQL_PROFILER"]:
+        return
+
+    _listen()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def _listen():
+    """Attach the cursor listeners once, to every engine in the process."""
+
+    global _listening
+
+    if _listening:
+        return
+
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+    _listening = True
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+
+    if has_request_context():
+        stats = g.get("sql_stats")
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+            stats.statements[statement] += 1
+
+    if (has_app_context() and current_app.config.get("SQL_PROFILER")
+            and elapsed * 1000 >= current_app.config["SQL_SLOW_QUERY_MS"]):
+        endpoint = request.endpoint if has_request_context() else None
+        logger.warning("Slow query (%.1fms) in %s: %s",
+                       elapsed * 1000, endpoint, statement)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute.
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
+
+def _start_request():
+    g.sql_stats = RequestStats()
+
+
+def _finish_request(response):
+    stats = g.pop("sql_stats", None)
+
+    if stats is None:
+        return response
+
+    db_ms = stats.seconds * 1000
+    response.headers["X-DB-Query-Count"] = str(stats.count)
+    response.headers["X-DB-Time-Ms"] = f"{db_ms:.1f}"
+
+    logger.info("%s %s %s queries=%d db_ms=%.1f",
+                request.method, request.path, response.status_code,
+                stats.count, db_ms)
+
+    threshold = current_app.config["SQL_REPEAT_THRESHOLD"]
+    for statement, times in stats.repeated(threshold):
+        logger.warning("Possible N+1 in %s: statement ran %d times: %s",
+                       request.endpoint, times, statement)
+
+    return response
@@ -0,0 +1,48 @@
+"""Streaming JSON responses for large collections.
+
+A streamed response has the same {"<key>": [...]} shape as the jsonify
+version, but rows are fetched with yield_per and written out one chunk at
+a time, so neither the ORM rows nor the encoded body for the whole
+collection are held in memory at once.
+"""
+
+from itertools import islice
+
+from flask import Response, current_app, stream_with_context
+
+STREAM_CHUNK_SIZE = 500
+
+
+def wants_stream(args):
+    """Return True if the request asked for a streamed response."""
+
+    return args.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def stream_json(key, query, serialize_many, chunk_size=STREAM_CHUNK_SIZE):
+    """Return a Response streaming {key: [...]} built from `query`.
+
+    `serialize_many` turns a list of rows into a list of dicts; it gets
+    one chunk at a time so it can batch work such as image signing.
+    """
+
+    def generate():
+        dumps = current_app.json.dumps
+        rows = iter(query.yield_per(chunk_size))
+        separator = ""
+
+        yield "{%s: [" % dumps(key)
+
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            yield separator + ",".join(
+                dumps(item) for item in serialize_many(chunk))
+            separator = ","
+
+        yield "]}"
+
+    return Response(stream_with_context(generate()),
+                    mimetype=current_app.json.mimetype)
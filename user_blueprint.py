@@ -1,10 +1,110 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import get_jwt_identity, jwt_required
+
+import availability
+import cache
+import conditional
+import purge
+import streaming
+from models import db, User, Property, Booking
 
 users = Blueprint('users', __name__)
 
+
 @users.get("/<username>")
-def get_user_info(username):
-    """Returns JSON of user data:
-    {first_name, last_name, email, is_owner}
+@jwt_required()
+def show_user(username):
+    """Given a username
+    Return JSON with user info
+    """
+
+    user = User.with_listings().filter_by(username=username).first_or_404()
+    return jsonify(user=user.serialize())
+
+
+@users.patch("/<username>")
+@jwt_required()
+def update_user(username):
+    """Given a username and formData
+    Return JSON with updated user info
+    """
+    current_user = get_jwt_identity()
+
+    if current_user != username:
+        return jsonify({"error": "Invalid Authorization"})
+
+    user = User.with_listings().filter_by(username=username).first_or_404()
+
+    user.first_name = request.form.get("first_name", user.first_name)
+    user.last_name = request.form.get("last_name", user.last_name)
+    user.email = request.form.get("email", user.email)
+
+    db.session.commit()
+
+    return jsonify(user=user.serialize())
+
+
+@users.delete("/<username>")
+@jwt_required()
+def delete_user(username):
+    """Given a username
+    Delete user from db
+    Return JSON with delete confirmation
+    """
+
+    current_user = get_jwt_identity()
+
+    if current_user != username:
+        return jsonify({"error": "Invalid Authorization"})
+
+    user = User.query.get_or_404(username)
+
+    if purge.is_large(username):
+        purge.submit(username)
+        return jsonify(deleted=user.username), 202
+
+    property_ids = db.session.scalars(
+        db.select(Property.id).where(Property.user == username)).all()
+    booked_ids = db.session.scalars(
+        db.select(Booking.property_id).distinct()
+        .where(Booking.username == username)).all()
+
+    # Properties and bookings go with the user via ON DELETE CASCADE.
+    db.session.delete(user)
+    db.session.commit()
+    cache.invalidate_properties(property_ids)
+    for property_id in {*property_ids, *booked_ids}:
+        availability.invalidate(property_id)
+
+    return jsonify(deleted=user.username)
+
+
+@users.get("/<username>/bookings")
+@jwt_required()
+def get_user_bookings(username):
+    """Given a username
+    Return JSON of all the bookings for that user
+
+    Optional query param stream: stream the bookings in chunks
+    """
+    User.query.get_or_404(username)
+
+    if get_jwt_identity() != username:
+        return jsonify({"error": "Invalid Authorization"})
+
+    bookings = (Booking.with_property()
+                .filter_by(username=username)
+                .order_by(Booking.start_date, Booking.id))
+    count, updated_at = Booking.collection_version(
+        Booking.username == username)
+    etag = conditional.make_etag("user-bookings", username,
+                                 request.query_string, count, updated_at)
+
+    def build():
+        if streaming.wants_stream(request.args):
+            return streaming.stream_json("bookings", bookings,
+                                         Booking.serialize_many)
+
+        return jsonify(bookings=Booking.serialize_many(bookings))
 
-    """
\ No newline at end of file
+    return conditional.respond(etag, updated_at, build)